@@ -2,14 +2,29 @@
 # Copyright (C) 2013-2024, Hear2Read Project Contributors
 # See the file COPYING for more details.
 
+import errno
+import gzip
+import json
 import os
+import queue
 import shutil
-import sys
-import urllib.request
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from ctypes import WinError, windll
 from dataclasses import dataclass
 from glob import glob
-from io import StringIO
-from threading import Thread
+from http.client import (
+    HTTPConnection,
+    HTTPException,
+    HTTPSConnection,
+    IncompleteRead,
+)
+from io import BytesIO, StringIO
+from threading import Event, Lock, Thread, local
+from typing import NamedTuple
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+from urllib.request import Request, getproxies, proxy_bypass, urlopen
 
 import addonHandler
 import config
@@ -69,7 +84,13 @@ H2RNG_VOICES_DOWNLOAD_HTTP = "https://hear2read.org/Hear2Read/voices-piper/"
 H2RNG_VOICE_LIST_URL = "https://hear2read.org/nvda-addon/getH2RNGVoiceNames.php"
 # H2RNG_VOICE_LIST_URL = "https://hear2read.org/nvda-addon/getH2RNG2VoiceNames.php"
 H2RNG_UPDATE_FLAG = os.path.join(H2RNG_DATA_DIR, "pendingUpdate")
+# marker touched after the data files are installed successfully
+H2RNG_INSTALL_MARKER = os.path.join(H2RNG_DATA_DIR, ".install_ok")
+# marker touched once no data from addon version 1.4 and lower is left
+H2RNG_MIGRATED_MARKER = os.path.join(H2RNG_DATA_DIR, ".migrated_from_v14")
 H2RNG_CONFIG_FILE = os.path.join(H2RNG_DATA_DIR, "h2rng.ini")
+# last voice list fetched from the server
+H2RNG_VOICE_LIST_CACHE = os.path.join(H2RNG_DATA_DIR, "voice_list_cache.json")
 # config section
 SCT_General = "General"
 SCT_EngSynth = "English"
@@ -84,15 +105,14 @@ ID_EnglishSynthVolume = "EnglishSynthVolume"
 ID_EnglishSynthPitch = "EnglishSynthPitch"
 ID_EnglishSynthInflection = "EnglishSynthInflection"
 
-try:
-    _dir=os.path.dirname(__file__.decode("mbcs"))
-except AttributeError:
-    _dir=os.path.dirname(__file__)
+_dir = os.path.dirname(__file__)
 
 _dir = os.path.abspath(os.path.join(_dir, os.pardir, os.pardir))
     
-OLD_H2RNG_DATA_DIR = os.path.join(os.environ['ALLUSERSPROFILE'], 
-                                  "Hear2Read-ng")
+OLD_H2RNG_DATA_DIR = os.path.join(
+    os.getenv("ALLUSERSPROFILE", r"C:\ProgramData"), "Hear2Read-ng")
+OLD_H2RNG_VOICES_DIR = os.path.join(OLD_H2RNG_DATA_DIR, "Voices")
+OLD_H2RNG_WAVS_DIR = os.path.join(OLD_H2RNG_DATA_DIR, "wavs")
 
 # try:
 #     _h2r_config = config.conf["hear2read"]
@@ -260,40 +280,120 @@ class H2RConfigManager():
 
 _h2r_config = H2RConfigManager()
 
-def copytree_compat(src, dst):
-    """Copytree version with overwrite compatible for Python < 3.8. This is
-    copied from the answer https://stackoverflow.com/a/13814557, and has a 
-    fairly basic functionality not accounting for symlinks, which is sufficient
-    for our purposes
 
-    @param src: path to the source, to be copied from
+def copyfile_win(src, dst):
+    """Copies the file at src to dst with CopyFileExW, which uses the kernel's
+    copy path with larger I/O sizes than shutil's read/write loop, and a 
+    server side copy when the source is on a network share. The file
+    attributes and timestamps are copied along with the data
+
+    @param src: path to the file to copy
     @type src: string
-    @param dst: path to the destination, to be copied to
+    @param dst: path to copy the file to
     @type dst: string
+    @raises OSError: if the copy fails
+    @return: dst, like the shutil copy functions
+    @rtype: string
     """
-    if not os.path.exists(dst):
-        os.makedirs(dst)
-    for item in os.listdir(src):
-        s = os.path.join(src, item)
-        d = os.path.join(dst, item)
-        if os.path.isdir(s):
-            copytree_compat(s, d)
-        else:
-            if not os.path.exists(d) or os.stat(s).st_mtime - os.stat(d).st_mtime > 1:
-                shutil.copy2(s, d)
-
-def copytree_overwrite(src, dst):
-    """Wrapper to enable consistent behaviour in Python version < 3.8
-
-    @param src: path to the source, to be copied from
+    if not windll.kernel32.CopyFileExW(src, dst, None, None, None, 0):
+        raise WinError()
+    return dst
+
+def move_tree(src, dst):
+    """Moves the tree at src into dst, overwriting existing files. Entries are
+    renamed into place, merging into directories that already exist in dst,
+    so no file data is copied when both are on the same volume. Entries on
+    another volume are copied instead. The emptied src dirs are removed as
+    they are done
+
+    @param src: path to the source, to be moved from
     @type src: string
-    @param dst: path to the destination, to be copied to
+    @param dst: path to the destination, to be moved to
     @type dst: string
+    @raises OSError: re-raises any error encountered while moving
     """
-    if sys.version_info >= (3, 8):
-        shutil.copytree(src=src, dst=dst, dirs_exist_ok=True)
-    else:
-        copytree_compat(src=src, dst=dst)
+    # a fresh destination takes the whole tree in a single rename
+    try:
+        os.rename(src, dst)
+        return
+    except OSError:
+        pass
+
+    os.makedirs(dst, exist_ok=True)
+    with os.scandir(src) as it:
+        for entry in it:
+            dst_path = os.path.join(dst, entry.name)
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_dir and os.path.isdir(dst_path):
+                move_tree(entry.path, dst_path)
+                continue
+            try:
+                os.replace(entry.path, dst_path)
+            except OSError as e:
+                # only this entry is copied across volumes
+                if e.errno != errno.EXDEV:
+                    raise
+                if is_dir:
+                    move_tree(entry.path, dst_path)
+                else:
+                    copyfile_win(entry.path, dst_path)
+                    os.remove(entry.path)
+    os.rmdir(src)
+
+def is_in_use(path):
+    """Checks whether the file at path is locked by a running process, e.g.
+    the engine dll while Hear2Read Indic is the current synth. Opening a
+    loaded dll for writing fails with a sharing violation
+
+    @param path: path to the file to check
+    @type path: string
+    @return: True if the file exists and cannot be opened for writing
+    @rtype: bool
+    """
+    try:
+        os.close(os.open(path, os.O_RDWR))
+    except PermissionError:
+        return True
+    except OSError:
+        pass
+    return False
+
+# size of the buffer used to copy files out of zip files
+ZIP_COPY_SIZE = 1 << 20
+
+def extract_zip(zipf, dst_dir):
+    """Extracts the files in zipf into dst_dir, skipping directory entries and
+    macOS metadata. Each file is written to a .part file first and renamed 
+    into place once complete
+
+    @param zipf: the zip file to extract
+    @type zipf: zipfile.ZipFile
+    @param dst_dir: path to extract the files into
+    @type dst_dir: string
+    @raises ValueError: raised if a member would be extracted outside dst_dir
+    """
+    dst_dir = os.path.abspath(dst_dir)
+    created_dirs = set()
+
+    for info in zipf.infolist():
+        name = info.filename
+        if (info.is_dir() or name.startswith("__MACOSX/") 
+            or name.endswith(".DS_Store")):
+            continue
+
+        target = os.path.abspath(os.path.join(dst_dir, name))
+        if os.path.commonpath((dst_dir, target)) != dst_dir:
+            raise ValueError(f"Unsafe path in zip file: {name}")
+
+        target_dir = os.path.dirname(target)
+        if target_dir not in created_dirs:
+            os.makedirs(target_dir, exist_ok=True)
+            created_dirs.add(target_dir)
+
+        part_path = target + ".part"
+        with zipf.open(info) as src, open(part_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, ZIP_COPY_SIZE)
+        os.replace(part_path, target)
 
 def postUpdateCheck():
     """Check if Hear2Read is being run post addon update, and rename the 
@@ -311,36 +411,120 @@ def postUpdateCheck():
         # log.info("Not post update, doing nothing")
         pass
 
-def check_files():
-    """
-    Checks whether the files and directories vital to Hear2Read Indic are 
-    present
+def _probe_files():
+    """Probes the files and directories vital to Hear2Read Indic
 
-    @return: returns True only if the engine DLL, the phoneme data dir
-    and at least one voice are present
+    @return: returns True only if the engine DLL and the phoneme data dir are
+    present
     @rtype: bool
     """
-    # dll_is_present = False
-    # phonedir_is_present = False
-    # voice_is_present = False
-
-    postUpdateCheck()
-
     try:
         if not os.path.isfile(H2RNG_ENGINE_DLL_PATH):
             return False
-            # dll_is_present = True
 
         if not os.listdir(H2RNG_PHONEME_DIR):
             return False
-            # phonedir_is_present = True
 
     except Exception as e:
-        log.warn(f"Hear2Read Indic check failed with exception: {e}")
+        log.warn("Hear2Read Indic check failed with exception: %s", e)
         return False
-            
+
     return True
-    # return dll_is_present and phonedir_is_present and voice_is_present
+
+# mtime of the install marker when the files last probed fine. The marker is
+# rewritten on every install, so a new mtime probes the files again. Failed
+# probes are not cached, so that a file missing for a moment, e.g. while the
+# dll is replaced, is probed again
+_check_files_cache = {"mtime": None}
+
+def check_files():
+    """
+    Checks whether the files and directories vital to Hear2Read Indic are 
+    present
+
+    @return: returns True only if the engine DLL and the phoneme data dir are
+    present
+    @rtype: bool
+    """
+    postUpdateCheck()
+
+    try:
+        key = os.stat(H2RNG_INSTALL_MARKER).st_mtime_ns
+    except OSError:
+        # no successful install recorded, always probe
+        _check_files_cache["mtime"] = None
+        return _probe_files()
+
+    if key == _check_files_cache["mtime"]:
+        return True
+
+    files_ok = _probe_files()
+    if files_ok:
+        _check_files_cache["mtime"] = key
+    return files_ok
+
+
+def fetch_server_voice_list():
+    """Gets the pipe separated voice file list from the server. The response 
+    is cached on disk, and every request is sent conditionally, so the cache
+    is reused if the list has not changed, or if the server cannot be reached
+
+    @raises HTTPError: raised on a server error
+    @raises URLError: raised if the server cannot be reached and there is no
+    cached list
+    @return: the voice file list
+    @rtype: string
+    """
+    try:
+        with open(H2RNG_VOICE_LIST_CACHE, encoding="utf-8") as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        cache = None
+
+    # a cache from an older format or a partial write is fetched again
+    if not (isinstance(cache, dict)
+            and isinstance(cache.get("response"), str)):
+        cache = None
+
+    headers = {"Accept-Encoding": "gzip"}
+    if cache and cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache and cache.get("last_modified"):
+        headers["If-Modified-Since"] = cache["last_modified"]
+
+    try:
+        with urlopen(Request(H2RNG_VOICE_LIST_URL, headers=headers)) as response:
+            resp_bytes = response.read()
+            if response.headers.get("Content-Encoding") == "gzip":
+                resp_bytes = gzip.decompress(resp_bytes)
+            resp_str = resp_bytes.decode('utf-8')
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    except HTTPError as e:
+        if not (cache and e.code == 304):
+            raise
+        resp_str = cache["response"]
+        etag = cache.get("etag")
+        last_modified = cache.get("last_modified")
+    except Exception as e:
+        if not cache:
+            raise
+        log.warn("Hear2Read unable to access internet, using cached voice "
+                 "list: %s", e)
+        return cache["response"]
+
+    cache = {"etag": etag,
+             "last_modified": last_modified,
+             "response": resp_str}
+    try:
+        with open(H2RNG_VOICE_LIST_CACHE + ".tmp", "w", 
+                  encoding="utf-8") as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(H2RNG_VOICE_LIST_CACHE + ".tmp", H2RNG_VOICE_LIST_CACHE)
+    except OSError as e:
+        log.warn("Hear2Read unable to cache voice list: %s", e)
+
+    return resp_str
 
 
 def parse_server_voices(resp_str):
@@ -351,65 +535,72 @@ def parse_server_voices(resp_str):
     """
     server_voices = {}
     server_files = resp_str.split('|')
+    server_file_set = frozenset(server_files)
     for file in server_files:
-        if file.startswith("en"):
+        if file.startswith("en") or not file.endswith(".onnx"):
             continue
-        parts = file.split(".")
-        if parts[-1] == "onnx":
-            if f"{file}.json" in server_files:
-                iso_lang = parts[0].split("-")[0].split("_")[0]
-                extra = False
-                if f"{file}.zip" in server_files:
-                    extra = True
-                if iso_lang in lang_names.keys():
-                    server_voices[iso_lang] = Voice(id=parts[0], 
-                            lang_iso=iso_lang,
-                            display_name=lang_names[iso_lang],
-                            state="Download", 
-                            extra=extra)
-                else:
-                    server_voices[iso_lang] = Voice(id=parts[0], 
+        if f"{file}.json" not in server_file_set:
+            continue
+
+        voice_id = file.partition(".")[0]
+        iso_lang = voice_id.split("-")[0].split("_")[0]
+        display_name = lang_names.get(iso_lang, f"Unknown Lang ({iso_lang})")
+        server_voices[iso_lang] = Voice(id=voice_id, 
                             lang_iso=iso_lang,
-                            display_name=f"Unknown Lang ({iso_lang})",
+                            display_name=display_name,
                             state="Download", 
-                            extra=extra)
+                            extra=f"{file}.zip" in server_file_set)
 
     return server_voices
 
 
+# result of populateVoices, keyed by the mtime of the voices dir
+_populate_cache = {"mtime": None, "voices": None}
+# the voice manager scans on a worker thread while the synth may scan on the
+# GUI thread, the lock keeps the cache and the duplicate removal consistent
+_populate_lock = Lock()
+
 def populateVoices():
     """Checks and populates voice list based on the files present in the voice
-    directory
+    directory. The result is cached until the voices dir changes
 
     @return: Dictionary of voice files keyed by the iso2 code of the language
     @rtype: dict
     """
-    remove_duplicate_voices()
-    voices = dict()
-    #list all files in Language directory
-    file_list = os.listdir(H2RNG_VOICES_DIR)
-    #FIXME: the english voice is obsolete, maybe remove the voiceid?
-    en_voice = EN_VOICE_ALOK
-    voices[en_voice] = "English"
-    for file in file_list:
-        list = file.split(".")
-        if list[-1] == "onnx":
-            if f"{file}.json" not in file_list:
+    with _populate_lock:
+        try:
+            mtime = os.stat(H2RNG_VOICES_DIR).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        if mtime is not None and mtime == _populate_cache["mtime"]:
+            return dict(_populate_cache["voices"])
+
+        remove_duplicate_voices()
+        voices = dict()
+        #list all files in Language directory
+        file_list = os.listdir(H2RNG_VOICES_DIR)
+        file_set = frozenset(file_list)
+        #FIXME: the english voice is obsolete, maybe remove the voiceid?
+        en_voice = EN_VOICE_ALOK
+        voices[en_voice] = "English"
+        for file in file_list:
+            if not file.endswith(".onnx") or f"{file}.json" not in file_set:
                 continue
-            nameList = list[0].split("-")
-            lang = nameList[0].split("_")[0]
-            
+            voice_id = file.partition(".")[0]
+            lang = voice_id.partition("-")[0].partition("_")[0]
+        
             # Already set the sole English voice
             if lang == "en":
                 continue
-            
-            language = lang_names.get(lang)
-            if language:
-                voices[list[0]] = language
-            else:
-                voices[list[0]] = f"Unknown language ({list[0]})"
+        
+            voices[voice_id] = lang_names.get(
+                lang, f"Unknown language ({voice_id})")
 
-    return voices
+        # stat again as remove_duplicate_voices may have changed the dir
+        _populate_cache["mtime"] = os.stat(H2RNG_VOICES_DIR).st_mtime_ns
+        _populate_cache["voices"] = voices
+        return dict(voices)
 
 def remove_duplicate_voices():
     """Ensures only one voice per language is present. Retains only the last
@@ -428,7 +619,7 @@ def remove_duplicate_voices():
         if len(lang_voices) > 1:
             for f in lang_voices[:-1]:
                 json_file = f + ".json"
-                log.warn(f"Hear2Read NG: Found duplicate voice, deleting: {f}")
+                log.warn("Hear2Read NG: Found duplicate voice, deleting: %s", f)
                 os.remove(os.path.join(H2RNG_VOICES_DIR, f))
                 if os.path.exists(os.path.join(H2RNG_VOICES_DIR, json_file)):
                     os.remove(os.path.join(H2RNG_VOICES_DIR, json_file))
@@ -444,49 +635,77 @@ def move_old_voices():
     moved to this version successfully
     @rtype: bool
     """
-    old_voices_dir = os.path.join(OLD_H2RNG_DATA_DIR, "Voices")
+    if os.path.isfile(H2RNG_MIGRATED_MARKER):
+        return False
+
     voices_moved = False
 
-    if os.path.isdir(OLD_H2RNG_DATA_DIR):
-        # try moving old voices
-        for file in os.listdir(old_voices_dir):
+    # a single scan of the old data dir tells which of its subdirs exist
+    try:
+        with os.scandir(OLD_H2RNG_DATA_DIR) as it:
+            old_dirs = {entry.name for entry in it 
+                        if entry.is_dir(follow_symlinks=False)}
+    except (FileNotFoundError, NotADirectoryError):
+        old_dirs = None
+
+    if old_dirs is not None:
+        # names already in the voices dir, so that existing voices are not
+        # overwritten
+        try:
+            with os.scandir(H2RNG_VOICES_DIR) as it:
+                existing = {entry.name for entry in it}
+        except FileNotFoundError:
+            existing = set()
+        # the voices dir is fixed, so the destination paths are built by
+        # plain concatenation
+        dst_base = H2RNG_VOICES_DIR + os.sep
+
+        # try moving old voices, failures are logged together at the end
+        old_voices = []
+        if os.path.basename(OLD_H2RNG_VOICES_DIR) in old_dirs:
+            with os.scandir(OLD_H2RNG_VOICES_DIR) as it:
+                old_voices = list(it)
+
+        failed = []
+        for entry in old_voices:
+            file = entry.name
+            # english and already present voices go with the old data dir
+            if file.startswith("en") or file in existing:
+                continue
+            dst_path = dst_base + file
             try:
-                src_path = os.path.join(old_voices_dir, file)
-                dst_path = os.path.join(H2RNG_VOICES_DIR, file)
-                if not file.startswith("en") and not os.path.isfile(dst_path):
-                    shutil.copy2(src=src_path, dst=dst_path)
-                    voices_moved = True
-                os.remove(src_path)
+                # a rename is enough on the same volume, fall back to a copy
+                # across volumes
+                try:
+                    os.replace(entry.path, dst_path)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.move(entry.path, dst_path)
+                existing.add(file)
+                voices_moved = True
             except Exception as e:
-                log.warn("Hear2Read Indic unable to remove old voice file: "
-                         f"{file}")
+                failed.append((file, str(e)))
+        if failed:
+            log.warn("Hear2Read Indic unable to move %d old voice files: %r", 
+                     len(failed), failed)
         
-        old_wavs_dir = os.path.join(OLD_H2RNG_DATA_DIR, "wavs")
-
-        if os.path.isdir(old_wavs_dir):
+        if os.path.basename(OLD_H2RNG_WAVS_DIR) in old_dirs:
             try:
-                copytree_overwrite(src=old_wavs_dir, dst=H2RNG_WAVS_DIR)
+                move_tree(src=OLD_H2RNG_WAVS_DIR, dst=H2RNG_WAVS_DIR)
             except Exception as e:
-                log.warn("Hear2Read Indic unable to copy old wav folders")
+                log.warn("Hear2Read Indic unable to move old wav folders: %s", e)
 
-        # try deleting old data
-        old_dirs = []
-        old_dirs.append(old_voices_dir)
-        old_dirs.append(old_wavs_dir)
-        old_dirs.append(os.path.join(OLD_H2RNG_DATA_DIR, "espeak-ng-data"))
-
-        for dir in old_dirs:
-            try:
-                if os.path.isdir(dir):
-                    shutil.rmtree(dir)
-            except Exception as e:
-                dirname = os.path.basename(dir)
-                log.warn(f"Hear2Read Indic unable to remove old folder: {dirname}")
+        # try deleting old data, everything left is removed in one pass
+        shutil.rmtree(OLD_H2RNG_DATA_DIR, ignore_errors=True)
 
+    # the failed scan already showed there is nothing to migrate
+    if old_dirs is None or not os.path.exists(OLD_H2RNG_DATA_DIR):
         try:
-            shutil.rmtree(OLD_H2RNG_DATA_DIR)
-        except Exception as e:
-            log.warn("Hear2Read Indic unable to remove old Hear2Read data folder")
+            open(H2RNG_MIGRATED_MARKER, "wb").close()
+        except OSError as e:
+            log.warn("Hear2Read Indic unable to mark old voices as moved: %s", 
+                     e)
             
     return voices_moved
 
@@ -509,38 +728,54 @@ def onInstall():
     # First check that the dll file is not in access, i.e., Hear2Read Indic is not
     # the current TTS synth
     if os.path.isdir(H2RNG_DATA_DIR):
+        dll_path = os.path.join(H2RNG_DATA_DIR, dll_name)
+        dll_in_use = is_in_use(dll_path)
+        if dll_in_use:
+            # Hear2Read Indic is the current synth, so the dll is replaced 
+            # after a restart
+            dll_path += ".update"
+        # gui.messageBox(
+        #     # Translators: message telling the user that Hear2Read Indic was not installed correctly
+        #     _("Unable to update Hear2Read Indic while it is running in NVDA\n"
+        #         "Please switch to a different synthesizer, restart NVDA and retry"),
+        #     # Translators: title of a message telling the user that Hear2Read Indic was not installed correctly
+        #     _("Hear2Read Indic Install Error"),
+        #     wx.OK | wx.ICON_ERROR)
+        # raise e
         try:
             # trying moving the dll first
-            shutil.move(os.path.join(src_dir, dll_name), 
-                        os.path.join(H2RNG_DATA_DIR, dll_name))
+            os.replace(os.path.join(src_dir, dll_name), dll_path)
             
             # if the data dir is already present, need to take further steps:
             # touch a file called update flag. This is to ensure proper update 
             # behaviour in NVDA - NVDA runs onUninstall when updating, deleting
             # old voices
-            os.remove(H2RNG_UPDATE_FLAG)
-        except Exception as e:
-            if dll_name in str(e):
-                shutil.move(os.path.join(src_dir, dll_name), 
-                        os.path.join(H2RNG_DATA_DIR, dll_name+".update"))
-                with open(H2RNG_UPDATE_FLAG, 'a'):
-                    os.utime(H2RNG_UPDATE_FLAG, None)
-                # gui.messageBox(
-                #     # Translators: message telling the user that Hear2Read Indic was not installed correctly
-                #     _("Unable to update Hear2Read Indic while it is running in NVDA\n"
-                #         "Please switch to a different synthesizer, restart NVDA and retry"),
-                #     # Translators: title of a message telling the user that Hear2Read Indic was not installed correctly
-                #     _("Hear2Read Indic Install Error"),
-                #     wx.OK | wx.ICON_ERROR)
-                # raise e
+            if dll_in_use:
+                os.close(os.open(H2RNG_UPDATE_FLAG, os.O_CREAT | os.O_WRONLY))
             else:
-                log.warn("Unable to update Hear2Read properly. Old voices may be deleted")
+                os.remove(H2RNG_UPDATE_FLAG)
+        except Exception as e:
+            log.warn("Unable to update Hear2Read properly. Old voices may be "
+                     "deleted: %s", e)
 
     try:
-        copytree_overwrite(src=src_dir, dst=H2RNG_DATA_DIR)
-        shutil.rmtree(src_dir)
+        move_tree(src=src_dir, dst=H2RNG_DATA_DIR)
+        open(H2RNG_INSTALL_MARKER, "wb").close()
     except Exception as e:
-        log.warn(f"Error installing Hear2Read Indic data files: {e}")
+        log.warn("Error installing Hear2Read Indic data files: %s", e)
+        # the addon dir is only left behind when the move failed, clear out
+        # any voices remaining in it
+        try:
+            with os.scandir(os.path.join(src_dir, "Voices")) as it:
+                src_voices = list(it)
+        except FileNotFoundError:
+            src_voices = []
+        for entry in src_voices:
+            try:
+                os.remove(entry.path)
+            except OSError as remove_error:
+                log.warn("Hear2Read Indic unable to remove file from addon "
+                         "dir: %s, Exception: %s", entry.name, remove_error)
         if dll_name in str(e):
             gui.messageBox(
                 # Translators: message telling the user that Hear2Read Indic was not installed correctly
@@ -551,15 +786,6 @@ def onInstall():
                 wx.OK | wx.ICON_ERROR)
             raise e
 
-    src_voice_dir = os.path.join(src_dir, "Voices")
-    if os.path.isdir(src_voice_dir):
-        for file in os.listdir(src_voice_dir):
-            try:
-                os.remove(os.path.join(src_voice_dir, file))
-            except Exception as e:
-                log.warn(f"Hear2Read Indic unable to remove file from addon dir: "
-                         f"{file}, Exception: {e}")
-
     move_old_voices()
 
 @dataclass
@@ -581,31 +807,69 @@ class Voice:
     extra: bool=False
 
 
+class DownloadItem(NamedTuple):
+    """A file to be downloaded by DownloadThread. A NamedTuple rather than a
+    slotted dataclass, as dataclass(slots=True) needs Python 3.10 and NVDA
+    2022.1 to 2023.3 ship Python 3.7:
+
+    @param path: location to save the file to
+    @param url: download URL of the file
+    @param size: expected size of the file in bytes, used for the progress if
+    the server does not send a Content-Length. 0 if unknown
+    """
+    path: str
+    url: str
+    size: int=0
+
+
 class DownloadThread(Thread):
     """Subclass of Thread to run downloads in the background. It accepts a list 
-    of downloads to perform, a list of tuples (<file location>, <download url>)
+    of downloads to perform, a list of DownloadItem
 
     @param Thread: the thread on which to run the download
     @type Thread: threading.Thread
     """
+    # minimum time in seconds between progress updates posted to the GUI
+    PROGRESS_INTERVAL = 0.1
+    # size in bytes of each read from the server
+    CHUNK_SIZE = 1 << 20
+    # number of parallel Range requests a large file is split into
+    RANGE_PARTS = 4
+    # files smaller than this (in bytes) are downloaded over one connection
+    RANGE_MIN_SIZE = 4 << 20
+    # number of files downloaded in parallel
+    FILE_WORKERS = 3
+    # maximum number of chunks waiting to be written to disk
+    WRITE_QUEUE_SIZE = 16
+    # seconds to wait on a stalled connection before giving up on it
+    TIMEOUT = 30
+    # number of times a dropped download is resumed before giving up
+    MAX_RESUMES = 3
+    # extra flags for the downloaded files, _O_SEQUENTIAL only exists on 
+    # Windows
+    OPEN_FLAGS = getattr(os, "O_SEQUENTIAL", 0)
+
     def __init__(self, download_queue, cancel_event, progress_callback,
-                 complete_callback, cancel_callback):
+                 complete_callback, cancel_callback, zips_in_memory=False):
         """_summary_
 
-        @param download_queue: list of tuples(pairs) of strings containing 
-        filename as first element and download URL as second 
-        @type download_queue: list(tuple(string, string))
+        @param download_queue: the files to download
+        @type download_queue: list(DownloadItem)
         @param cancel_event: threading event that is set if the cancel button is 
         pressed
         @type cancel_event: threading.Event
         @param progress_callback: callback to update progress of download. 
-        Updates percent of file downloaded
+        Updates percent of all the files downloaded
         @type progress_callback: function
         @param complete_callback: called on successful completion of download
         @type complete_callback: function
         @param cancel_callback: called on interruption of download. Takes an 
         optional error message if download is interrupted due to an Exception
         @type cancel_callback: function(error_message=None)
+        @param zips_in_memory: optional, if set .zip files are kept in 
+        memory in archives instead of being written to their location, for
+        the caller to extract once the download is complete
+        @type zips_in_memory: bool
         """
         super().__init__()
         
@@ -614,33 +878,427 @@ class DownloadThread(Thread):
         self.progress_callback = progress_callback
         self.complete_callback = complete_callback
         self.cancel_callback = cancel_callback
+        self.zips_in_memory = zips_in_memory
+        # .zip files downloaded into memory if zips_in_memory is set
+        self.archives = []
+        # set if any of the files fails, to stop the others early
+        self._failed_event = Event()
+        self._progress_lock = Lock()
+        self._total_size = 0
+        self._unknown_sizes = 0
+        self._downloaded = 0
+        self._last_percent = -1
+        self._last_update = 0
+        # per thread connections, keyed by (scheme, host), kept open across 
+        # the files in download_queue
+        self._local = local()
+        self._connections = []
+        self._connections_lock = Lock()
+        # the system (or environment) proxies, as urlopen would use them
+        self._proxies = getproxies()
 
     def run(self):
+        workers = max(min(self.FILE_WORKERS, len(self.download_queue)), 1)
+        # the range parts of all the files share one pool, so that their 
+        # threads, and the connections they hold, are reused across files
+        self._range_executor = ThreadPoolExecutor(
+                                    max_workers=self.RANGE_PARTS * workers)
         try:
-            for download in self.download_queue:
-                with urllib.request.urlopen(download[1]) as response:
-                    total_size = response.length
-                    with open(download[0], 'wb') as out_file:
-                        downloaded = 0
-                        while not self.cancel_event.is_set():
-                            chunk = response.read(8192)
-                            if not chunk:
-                                break
-                            
-                            out_file.write(chunk)
-                            downloaded += len(chunk)
-
-                            percent = min(int(downloaded * 100 / total_size), 100)
-                            wx.CallAfter(self.progress_callback, percent)
-
-                        if self.cancel_event.is_set():
-                            wx.CallAfter(self.cancel_callback)
-                            return
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # the sizes of all the files are probed upfront for the 
+                # overall progress
+                probes = list(executor.map(lambda item: 
+                                               self.probe_file(item.url, 
+                                                               item.size),
+                                           self.download_queue))
+                self._total_size = sum(size for size, _ in probes)
+                # files whose size is only known once their GET response 
+                # arrives
+                self._unknown_sizes = sum(1 for size, _ in probes if not size)
+
+                futures = [executor.submit(self.download_file, item.path, 
+                                           item.url, *probe)
+                           for item, probe in zip(self.download_queue, 
+                                                  probes)]
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception:
+                        # stop the other files early
+                        self._failed_event.set()
+                        raise
+
+            if self.cancel_event.is_set():
+                wx.CallAfter(self.cancel_callback)
+                return
                         
             wx.CallAfter(self.complete_callback)
             
         except Exception as e:
             wx.CallAfter(self.cancel_callback, error_message=str(e))
+        finally:
+            self._range_executor.shutdown()
+            self.close_connections()
+
+    def is_stopped(self):
+        """@return: True if the download is cancelled or any file failed
+        @rtype: bool
+        """
+        return self.cancel_event.is_set() or self._failed_event.is_set()
+
+    def is_proxied(self, scheme, host):
+        """@return: True if requests to host go through a system proxy
+        @rtype: bool
+        """
+        return bool(self._proxies.get(scheme)) and not proxy_bypass(host)
+
+    def get_connection(self, scheme, host):
+        """Returns the calling thread's connection to host, opening one if
+        needed. A connection is only used by one thread at a time
+
+        @param scheme: URL scheme, "http" or "https"
+        @type scheme: string
+        @param host: host (and optional port) to connect to
+        @type host: string
+        @return: the connection to the host
+        @rtype: http.client.HTTPConnection
+        """
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+
+        connection = connections.get((scheme, host))
+        if connection is None:
+            connection_class = (HTTPSConnection if scheme == "https" 
+                                else HTTPConnection)
+            connection = connections[(scheme, host)] = connection_class(
+                                                host, timeout=self.TIMEOUT)
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def close_connections(self):
+        """Closes all the connections opened by this download
+        """
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+    def open_url(self, url, method="GET", headers=None):
+        """Sends a request over a reused connection to the host of url. The 
+        response must be read fully (or the connections closed) before the 
+        calling thread sends another request. Requests through a proxy, and
+        redirects, are left to urlopen
+
+        @param url: URL to request
+        @type url: string
+        @param method: HTTP method of the request
+        @type method: string
+        @param headers: extra headers to send with the request
+        @type headers: dict
+        @raises HTTPError: raised on an error status
+        @return: the response to the request
+        @rtype: http.client.HTTPResponse
+        """
+        headers = headers or {}
+        parts = urlsplit(url)
+        if self.is_proxied(parts.scheme, parts.hostname):
+            return urlopen(Request(url, headers=headers, method=method), 
+                           timeout=self.TIMEOUT)
+
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        connection = self.get_connection(parts.scheme, parts.netloc)
+        try:
+            connection.request(method, target, headers=headers)
+            response = connection.getresponse()
+        except (HTTPException, OSError):
+            # the server may have dropped the idle connection, retry once on
+            # a new one
+            connection.close()
+            connection.request(method, target, headers=headers)
+            response = connection.getresponse()
+
+        location = response.getheader("Location")
+        if response.status in (301, 302, 303, 307, 308) and location:
+            response.read()
+            return urlopen(Request(urljoin(url, location), headers=headers, 
+                                   method=method), 
+                           timeout=self.TIMEOUT)
+
+        if response.status >= 400:
+            response.read()
+            raise HTTPError(url, response.status, response.reason,
+                            response.headers, None)
+
+        return response
+
+    def open_output(self, path, mode):
+        """Opens a file to download into. The file is unbuffered, the chunks
+        read from the server are already large and are written straight to 
+        the OS
+
+        @param path: location of the file
+        @type path: string
+        @param mode: file mode, 'wb' or 'r+b'
+        @type mode: string
+        @return: the opened file
+        @rtype: io.FileIO
+        """
+        return open(path, mode, buffering=0,
+                    opener=lambda file, flags: os.open(file, 
+                                                       flags | self.OPEN_FLAGS))
+
+    def probe_file(self, url, expected_size=0):
+        """Sends a HEAD request for the file to find its size and whether the
+        server accepts Range requests for it. If the HEAD request fails, the
+        file is streamed with a plain GET
+
+        @param url: download URL of the file
+        @type url: string
+        @param expected_size: size of the file in bytes if known beforehand, 
+        used if the server does not report it, defaults to 0 (unknown)
+        @type expected_size: int, optional
+        @return: the size of the file in bytes (0 if unknown), and whether it
+        can be downloaded in ranges
+        @rtype: tuple(int, bool)
+        """
+        try:
+            with self.open_url(url, method="HEAD") as response:
+                response.read()
+                total_size = (int(response.headers.get("Content-Length", 0)) 
+                              or expected_size)
+                accepts_ranges = (response.headers.get("Accept-Ranges") 
+                                  == "bytes")
+        except (HTTPException, OSError) as e:
+            # some servers and CDNs reject or mishandle HEAD
+            log.warn("Hear2Read HEAD request failed for %s, downloading "
+                     "without it: %s", url, e)
+            return expected_size, False
+        return total_size, accepts_ranges
+
+    def download_file(self, path, url, total_size, accepts_ranges):
+        """Downloads a single file. Large files are fetched as several HTTP 
+        Range requests in parallel if the server supports them, others are
+        streamed over a single connection
+
+        @param path: location to save the file to
+        @type path: string
+        @param url: download URL of the file
+        @type url: string
+        @param total_size: size of the file in bytes, 0 if unknown
+        @type total_size: int
+        @param accepts_ranges: whether the server accepts Range requests
+        @type accepts_ranges: bool
+        """
+        if self.zips_in_memory and url.endswith(".zip"):
+            self.archives.append(self.download_to_memory(url, total_size))
+        elif accepts_ranges and total_size >= self.RANGE_MIN_SIZE:
+            self.download_ranges(path, url, total_size)
+        else:
+            self.download_stream(path, url, total_size)
+
+    def download_to_memory(self, url, total_size=0):
+        """Downloads the file into memory, for archives that are extracted
+        by the caller so do not need to be written to disk
+
+        @param url: download URL of the file
+        @type url: string
+        @param total_size: size of the file in bytes, 0 if unknown
+        @type total_size: int, optional
+        @return: the contents of the file
+        @rtype: io.BytesIO
+        """
+        buffer = BytesIO()
+
+        with self.open_url(url) as response:
+            if not total_size:
+                self.add_total_size(response.length)
+            while not self.is_stopped():
+                chunk = response.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                buffer.write(chunk)
+                self.add_progress(len(chunk))
+
+        buffer.seek(0)
+        return buffer
+
+    def download_stream(self, path, url, total_size=0):
+        """Downloads the file over a single connection. The chunks received
+        are handed to a writer thread through a bounded queue, so that the
+        network reads do not wait on the disk writes. If the connection drops
+        the download is resumed from the last byte received
+
+        @param path: location to save the file to
+        @type path: string
+        @param url: download URL of the file
+        @type url: string
+        @param total_size: size of the file in bytes, 0 if unknown
+        @type total_size: int, optional
+        """
+        write_queue = queue.Queue(maxsize=self.WRITE_QUEUE_SIZE)
+        write_errors = []
+
+        def writer(out_file):
+            while True:
+                chunk = write_queue.get()
+                if chunk is None:
+                    break
+                if write_errors:
+                    # keep draining so the reader is never blocked
+                    continue
+                try:
+                    out_file.write(chunk)
+                except Exception as e:
+                    write_errors.append(e)
+
+        with self.open_output(path, 'wb') as out_file:
+            writer_thread = Thread(target=writer, args=(out_file,), 
+                                   daemon=True)
+            writer_thread.start()
+            try:
+                # bytes received so far, a dropped connection is resumed 
+                # from here with a Range request
+                received = 0
+                size_known = bool(total_size)
+                for attempt in range(self.MAX_RESUMES + 1):
+                    headers = {"Range": f"bytes={received}-"} if received else {}
+                    try:
+                        with self.open_url(url, headers=headers) as response:
+                            if received and response.status != 206:
+                                raise HTTPError(url, response.status, 
+                                                "Unable to resume download",
+                                                response.headers, None)
+                            if not size_known:
+                                self.add_total_size(response.length)
+                                size_known = True
+                            while not (self.is_stopped() or write_errors):
+                                chunk = response.read(self.CHUNK_SIZE)
+                                if not chunk:
+                                    # http.client does not raise if the 
+                                    # connection closes early
+                                    if response.length:
+                                        raise IncompleteRead(b"", 
+                                                             response.length)
+                                    break
+
+                                write_queue.put(chunk)
+                                received += len(chunk)
+                                self.add_progress(len(chunk))
+                        break
+                    except HTTPError:
+                        raise
+                    except (HTTPException, OSError) as e:
+                        if attempt == self.MAX_RESUMES or self.is_stopped():
+                            raise
+                        log.warn("Hear2Read download interrupted, resuming "
+                                 "from byte %d: %s", received, e)
+            finally:
+                write_queue.put(None)
+                writer_thread.join()
+
+        if write_errors:
+            raise write_errors[0]
+
+    def download_ranges(self, path, url, total_size):
+        """Splits the file into RANGE_PARTS byte ranges and downloads them in
+        parallel, each into its own region of a preallocated file
+
+        @param path: location to save the file to
+        @type path: string
+        @param url: download URL of the file
+        @type url: string
+        @param total_size: size of the file in bytes
+        @type total_size: int
+        """
+        part_size = -(-total_size // self.RANGE_PARTS)
+        ranges = [(start, min(start + part_size, total_size) - 1)
+                  for start in range(0, total_size, part_size)]
+
+        with open(path, 'wb') as out_file:
+            out_file.truncate(total_size)
+
+        futures = [self._range_executor.submit(self.download_range, path, url,
+                                               start, end)
+                   for start, end in ranges]
+        wait(futures)
+
+        for future in futures:
+            future.result()
+
+    def download_range(self, path, url, start, end):
+        """Downloads the bytes start to end (inclusive) of the file into the 
+        same position in the file at path
+
+        @raises HTTPError: raised if the server does not respond with the 
+        requested range
+        """
+        buffer = bytearray(self.CHUNK_SIZE)
+        buffer_view = memoryview(buffer)
+        try:
+            with self.open_url(url, headers={"Range": f"bytes={start}-{end}"}
+                               ) as response:
+                if response.status != 206:
+                    raise HTTPError(url, response.status, 
+                                    "Range request not honoured", 
+                                    response.headers, None)
+                with self.open_output(path, 'r+b') as out_file:
+                    out_file.seek(start)
+                    while not self.is_stopped():
+                        read_size = response.readinto(buffer)
+                        if not read_size:
+                            if response.length:
+                                raise IncompleteRead(b"", response.length)
+                            break
+
+                        out_file.write(buffer_view[:read_size])
+                        self.add_progress(read_size)
+        except Exception:
+            self._failed_event.set()
+            raise
+
+    def add_total_size(self, size):
+        """Adds the size of a file that was unknown when the download started,
+        from the Content-Length of its GET response. The overall progress is 
+        only posted once the sizes of all the files are known
+
+        @param size: size of the file in bytes, None if the server did not 
+        send it
+        @type size: int
+        """
+        if not size:
+            return
+        with self._progress_lock:
+            self._total_size += size
+            self._unknown_sizes -= 1
+
+    def add_progress(self, size):
+        """Adds to the downloaded byte count of all the files and posts the
+        progress to the GUI thread. Progress is only posted when the percentage
+        changes, and not more often than PROGRESS_INTERVAL
+
+        @param size: number of bytes just downloaded
+        @type size: int
+        """
+        with self._progress_lock:
+            self._downloaded += size
+            if self._unknown_sizes or not self._total_size:
+                return
+            percent = min(self._downloaded * 100 // self._total_size, 100)
+            if percent == self._last_percent:
+                return
+            now = time.monotonic()
+            if (percent < 100 and 
+                now - self._last_update < self.PROGRESS_INTERVAL):
+                return
+            self._last_percent = percent
+            self._last_update = now
+        wx.CallAfter(self.progress_callback, percent)
 
     def cancel(self):
         self.cancel_event.set()
@@ -2,14 +2,13 @@
 # Copyright (C) 2013-2024, Hear2Read Project Contributors
 # See the file COPYING for more details.
 
-import glob
 import operator
 import os
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
 from threading import Event, Thread
-from urllib import request
 from urllib.error import HTTPError
 
 import core
@@ -23,12 +22,14 @@ from synthDrivers._H2R_NG_Speak import H2RNG_DATA_DIR, H2RNG_VOICES_DIR
 
 from .h2rutils import (
     # H2RNG_DATA_DIR,
-    H2RNG_VOICE_LIST_URL,
     # H2RNG_VOICES_DIR,
     H2RNG_VOICES_DOWNLOAD_HTTP,
+    DownloadItem,
     DownloadThread,
     Voice,
     check_files,
+    extract_zip,
+    fetch_server_voice_list,
     # lang_names,
     onInstall,
     parse_server_voices,
@@ -39,6 +40,10 @@ from .h2rutils import (
 
 DLL_FILE_NAME_PREFIX = "Hear2ReadNG_addon_engine"
 DOWNLOAD_SUFFIX = ".download"
+# space in pixels added to the measured text width of the list columns
+COLUMN_PADDING = 16
+# runs the voice install tasks off the GUI thread
+_install_executor = ThreadPoolExecutor(max_workers=1)
 
 
 # TODO remove copyright, add copyright
@@ -190,33 +195,46 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
         """Helper function to populate the UI ListCtrl of the voices with the 
         appropriate on click functionality
         """
-        # Add voices to the list
-        for voice in self.display_voices:
-            if voice.lang_iso in self.update_langs.keys():
-                self.list_ctrl.Append([voice.display_name, "Update"])
-            else:
-                self.list_ctrl.Append([voice.display_name, voice.state])
-
-        self.list_ctrl.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.on_click_item)
-
-        if self.display_voices:
-            self.list_ctrl.SetColumnWidth(0, wx.LIST_AUTOSIZE)
-            self.list_ctrl.SetColumnWidth(1, wx.LIST_AUTOSIZE)
-
-        if self.list_ctrl.GetColumnWidth(1) < 130:
-            self.list_ctrl.SetColumnWidth(0, 145)
-            self.list_ctrl.SetColumnWidth(1, 135)
-
-        self.list_ctrl.SetMinSize((self.title_text.GetSize().GetWidth(), -1))
-
-        self.vbox.Add(self.vboxHelper.sizer, border=10, flag=wx.ALL)
-        self.vbox.Fit(self)
-        self.SetSizer(self.vbox)
-        # TODO check if redundant
-        self.vbox.Fit(self)
+        update_langs = self.update_langs
 
-        self.Fit()
-        self.Layout()
+        # Add voices to the list and lay out the dialog without repainting 
+        # after every step
+        self.Freeze()
+        try:
+            actions = set()
+            for voice in self.display_voices:
+                action = ("Update" if voice.lang_iso in update_langs 
+                          else voice.state)
+                actions.add(action)
+                self.list_ctrl.Append([voice.display_name, action])
+
+            self.list_ctrl.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.on_click_item)
+
+            if self.display_voices:
+                # measure the columns in a single pass instead of having
+                # wx.LIST_AUTOSIZE measure every row of every column
+                name_width = max(self.list_ctrl.GetTextExtent(
+                                    voice.display_name)[0]
+                                 for voice in self.display_voices)
+                action_width = max(self.list_ctrl.GetTextExtent(action)[0]
+                                   for action in actions)
+                self.list_ctrl.SetColumnWidth(0, name_width + COLUMN_PADDING)
+                self.list_ctrl.SetColumnWidth(1, action_width + COLUMN_PADDING)
+
+            if self.list_ctrl.GetColumnWidth(1) < 130:
+                self.list_ctrl.SetColumnWidth(0, 145)
+                self.list_ctrl.SetColumnWidth(1, 135)
+
+            self.list_ctrl.SetMinSize((self.title_text.GetSize().GetWidth(), 
+                                       -1))
+
+            self.vbox.Add(self.vboxHelper.sizer, border=10, flag=wx.ALL)
+            self.SetSizer(self.vbox)
+            self.vbox.Fit(self)
+
+            self.Layout()
+        finally:
+            self.Thaw()
         
         # on the event of server error, warn the user and inform that only 
         # voices already installed are being shown
@@ -246,10 +264,12 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
         @type voice: utils.Voice
         """
         # TODO remove wav files as well
-        voice_files = Path(H2RNG_VOICES_DIR).glob(f"{voice.id}*")
+        with os.scandir(H2RNG_VOICES_DIR) as it:
+            voice_files = [entry.path for entry in it 
+                           if entry.name.startswith(voice.id)]
 
         for f in voice_files:
-            f.unlink()
+            os.unlink(f)
 
     def on_click_item(self, event):
         """On click event handler for the items in the list of voices. Depending
@@ -275,31 +295,31 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
         @param voice: the Voice object of the voice to be downloaded
         @type voice: utils.Voice
         """
-        # list of tuples of files and respective download URLs
+        # list of files and respective download URLs
         download_queue = []
 
         # the main model file
         file = f"{voice.id}.onnx"
         download_url = f"{H2RNG_VOICES_DOWNLOAD_HTTP}{file}"
         # log.info(f"download_voice on: {voice.id}, URL: {download_url}")
-        download_queue.append((os.path.join(H2RNG_VOICES_DIR,
-                                            f"{file}{DOWNLOAD_SUFFIX}"), 
-                               download_url))
+        download_queue.append(DownloadItem(os.path.join(H2RNG_VOICES_DIR,
+                                                f"{file}{DOWNLOAD_SUFFIX}"), 
+                                           download_url))
         
         # the model config file
         file_config = f"{file}.json"
         download_url_config = f"{H2RNG_VOICES_DOWNLOAD_HTTP}{file_config}"
-        download_queue.append((os.path.join(H2RNG_VOICES_DIR,
+        download_queue.append(DownloadItem(os.path.join(H2RNG_VOICES_DIR,
                                             f"{file_config}{DOWNLOAD_SUFFIX}"),  
-                               download_url_config))
+                                           download_url_config))
         
         # the extras file, if present
         if voice.extra:
             file_extra = f"{file}.zip"
             download_url_extra = f"{H2RNG_VOICES_DOWNLOAD_HTTP}{file_extra}"
-            download_queue.append((os.path.join(H2RNG_VOICES_DIR,
+            download_queue.append(DownloadItem(os.path.join(H2RNG_VOICES_DIR,
                                              f"{file_extra}{DOWNLOAD_SUFFIX}"),  
-                                   download_url_extra))
+                                               download_url_extra))
 
         # Show progress dialog
         self.progress_dialog = wx.ProgressDialog("Downloading",
@@ -312,7 +332,8 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
                     cancel_event = Event(),
                     progress_callback=self.update_progress,
                     complete_callback=lambda: self.on_download_complete(voice),
-                    cancel_callback=partial(self.on_download_cancel, voice))
+                    cancel_callback=partial(self.on_download_cancel, voice),
+                    zips_in_memory=True)
 
         self.download_thread.start()
 
@@ -395,19 +416,28 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
         @param voice: the Voice object of the voice downloaded
         @type voice: utils.Voice
         """
-        voice_install_event = Event()
-
         if self.progress_dialog:
             self.progress_dialog.Destroy()
             self.progress_dialog = None
 
+        # the extras zip, if present, is only extracted now that all the 
+        # files have downloaded
+        archives = self.download_thread.archives
+        # the dialog state is read here on the GUI thread, as the install 
+        # tasks run on a background thread
+        curr_index = self.curr_index
+        old_voice = self.update_langs.get(voice.lang_iso)
+
+        # the dialog is disabled until the install is done
+        window_disabler = wx.WindowDisabler()
         installing_dialog = wx.BusyInfo("Installing {}... Please wait ", 
                                         parent=self)
         wx.Yield()
 
         def dismiss_installing_dialog():
-            nonlocal installing_dialog
+            nonlocal installing_dialog, window_disabler
             installing_dialog = None
+            window_disabler = None
 
         def post_install_tasks(voice):
             """Handles UI changes after all install tasks are complete. 
@@ -417,11 +447,13 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
             @param voice: the Voice object of the voice installed
             @type voice: utils.Voice
             """
-            # TODO the thread seems redundant, check
-            self.list_ctrl.SetItem(self.curr_index, 1, "Remove")
-
             dismiss_installing_dialog()
 
+            if not self:
+                return
+
+            self.list_ctrl.SetItem(curr_index, 1, "Remove")
+
             gui.messageBox(_(f"{voice.display_name} installed successfully "),
                         _("Download Complete"), 
                         wx.OK | wx.ICON_INFORMATION)
@@ -449,36 +481,46 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
             @param voice: the Voice object of the voice being installed
             @type voice: utils.Voice
             """
-            voice_files = Path(H2RNG_VOICES_DIR).glob(f"{voice.id}*")
+            with os.scandir(H2RNG_VOICES_DIR) as it:
+                voice_files = [entry.path for entry in it 
+                               if entry.name.startswith(voice.id) 
+                               and entry.name.endswith(DOWNLOAD_SUFFIX)
+                               and entry.is_file()]
+
+            # remove the download suffix
             for file in voice_files:
-                if file.is_file():
-                    # Check if the filename ends with suffix and remove
-                    if file.match(f"*{DOWNLOAD_SUFFIX}"):
-                        new_file = file.with_suffix("")
-                        os.rename(file, new_file)
-                    
-                    # extract extra files
-                    if new_file.match("*.zip"):
-                        with zipfile.ZipFile(new_file, 'r') as zipf:
-                            zipf.extractall(H2RNG_DATA_DIR)
-                        new_file.unlink()
+                os.rename(file, file[:-len(DOWNLOAD_SUFFIX)])
+
+            # extract extra files
+            for archive in archives:
+                with zipfile.ZipFile(archive) as zipf:
+                    extract_zip(zipf, H2RNG_DATA_DIR)
+
+        def forget_old_voice(old_voice):
+            """Removes the old voice from the voice updates dictionary 
+            maintained. Runs on the GUI thread
+
+            @param old_voice: the Voice object of the voice removed
+            @type old_voice: utils.Voice
+            """
+            if self:
+                self.update_langs.pop(old_voice.lang_iso, None)
 
         def remove_old_voice(old_voice):
-            """Removes old voice files and the corresponding entry from the
-            voice updates dictionary maintained.
+            """Removes old voice files and queues the removal of the 
+            corresponding entry from the voice updates dictionary maintained.
 
             @param old_voice: the Voice object of the voice being removed
             @type old_voice: utils.Voice
             """
             if Path(H2RNG_VOICES_DIR, f"{old_voice.id}.onnx"):
                 self.delete_voice_files(old_voice)
-            self.update_langs.pop(old_voice.lang_iso)
+            wx.CallAfter(forget_old_voice, old_voice)
 
         def voice_install_tasks(voice):
             """Function performing the install tasks of renaming downloaded 
-            files, removing old voice files, and extracting the extras zipfile.
-            Finally, sets the voice_install_event, allowing for post install
-            tasks to be performed
+            files and removing old voice files. Finally, queues the post 
+            install tasks on the GUI thread
 
             @param voice: the Voice object of the voice being installed
             @type voice: utils.Voice
@@ -486,7 +528,6 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
             try:
                 remove_suffix_extract(voice)
                 # Check if updating an older voice, remove old voice
-                old_voice = self.update_langs.get(voice.lang_iso)
                 if old_voice:
                     remove_old_voice(old_voice)
             except Exception as e:
@@ -499,13 +540,10 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
                     wx.OK | wx.ICON_ERROR))
             finally:
                 wx.CallAfter(lambda: post_install_tasks(voice))
-                voice_install_event.set()
-
-        # Start the install tasks on a background thread
-        Thread(target=lambda: voice_install_tasks(voice)).start()
 
-        # wait for install to complete
-        voice_install_event.wait()
+        # Start the install tasks on a background thread, the GUI is updated
+        # by post_install_tasks once they are done
+        _install_executor.submit(voice_install_tasks, voice)
 
     def on_download_cancel(self, voice, error_message=None):
         """Callback on the event the download is interrupted. In case the 
@@ -557,14 +595,19 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
         if not os.path.isdir(H2RNG_VOICES_DIR):
             return installed_voices
 
-        # clear incomplete downloads -shyam
-        for voice_file in glob.glob(os.path.join(H2RNG_VOICES_DIR,
-                                                  f"*.{DOWNLOAD_SUFFIX}")):
-            os.remove(voice_file)
-
-        # remove obsolete English voice
-        for voice_file in glob.glob(os.path.join(H2RNG_VOICES_DIR, "en*")):
-            os.remove(voice_file)
+        # clear incomplete downloads -shyam, and remove obsolete English voice
+        with os.scandir(H2RNG_VOICES_DIR) as it:
+            for entry in it:
+                if not (entry.name.endswith(DOWNLOAD_SUFFIX) 
+                        or entry.name.startswith("en")):
+                    continue
+                try:
+                    os.unlink(entry.path)
+                except OSError as e:
+                    # a download still being written cannot be removed on
+                    # Windows, it is left for the next scan
+                    log.warn("Hear2Read Indic unable to remove %s: %s", 
+                             entry.name, e)
 
         for id, display_name in populateVoices().items():
             if id.startswith("en"):
@@ -597,11 +640,10 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
             server_error_event/network_error_event attribute in case of failure 
             """
             try:
-                with request.urlopen(H2RNG_VOICE_LIST_URL) as response:
-                    resp_str = response.read().decode('utf-8')
-                    self.server_voices = parse_server_voices(resp_str)
-                    # log.info(f"parse_server_voices: {self.server_voices}")
-                    # parse_server_voices(resp_str)
+                resp_str = fetch_server_voice_list()
+                self.server_voices = parse_server_voices(resp_str)
+                # log.info(f"parse_server_voices: {self.server_voices}")
+                # parse_server_voices(resp_str)
             except HTTPError as http_e:
                 self.server_error_event.set()
                 log.warn(f"Hear2Read http error: {http_e}")
@@ -622,21 +664,37 @@ class Hear2ReadNGVoiceManagerDialog(wx.Dialog):
         and voices available online. Modifies the attribute display_voices to
         be a list of Voice objects and sorts it by display_name
         """
-        self.installed_voices = self.get_installed_voices()
-        self.get_server_voices()
+        # scan the installed voices while the server list is being fetched,
+        # result() raises any error from the scan here
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            installed_future = executor.submit(self.get_installed_voices)
+            self.get_server_voices()
+            self.installed_voices = installed_future.result()
 
         if not self.server_voices:
-            self.display_voices = sorted(list(self.installed_voices.values()),
+            self.display_voices = sorted(self.installed_voices.values(),
                                     key=operator.attrgetter("display_name"))
             return
+
+        # TODO: this is redundant now as it will be updated post fact. will
+        # need a file on the server informing this. Maybe move voices to a
+        # new location to prevent access by old versions?
+        skip_sa = self.major_version > 0 and self.minor_version > 7
+
+        # nothing to download or update, only the installed voices are shown
+        installed_ids = {key: voice.id 
+                         for key, voice in self.installed_voices.items()}
+        server_ids = {key: voice.id 
+                      for key, voice in self.server_voices.items()}
+        if installed_ids == server_ids:
+            self.display_voices = sorted(
+                    (voice for key, voice in self.installed_voices.items()
+                     if not (key == "sa" and skip_sa)),
+                    key=operator.attrgetter("display_name"))
+            return
         
-        for key in set(self.installed_voices.keys()).union(
-                                                    self.server_voices.keys()):
-            
-            # TODO: this is redundant now as it will be updated post fact. will
-            # need a file on the server informing this. Maybe move voices to a
-            # new location to prevent access by old versions?
-            if key == "sa" and self.major_version > 0 and self.minor_version > 7:
+        for key in self.installed_voices.keys() | self.server_voices.keys():
+            if key == "sa" and skip_sa:
                 continue
 
             local_voice = self.installed_voices.get(key)
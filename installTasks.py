@@ -2,12 +2,11 @@
 # Copyright (C) 2013-2024, Hear2Read Project Contributors
 # See the file COPYING for more details.
 
+import errno
 import os
 import shutil
-import sys
+from ctypes import WinError, windll
 
-import gui
-import wx
 from logHandler import log
 
 # repeating path variable initializations as importing from modules is not 
@@ -16,98 +15,127 @@ H2RNG_DATA_DIR = os.path.join(os.getenv("APPDATA"), "Hear2Read-NG")
 H2RNG_VOICES_DIR = os.path.join(H2RNG_DATA_DIR, "Voices")
 H2RNG_WAVS_DIR = os.path.join(H2RNG_DATA_DIR, "wavs")
 H2RNG_UPDATE_FLAG = os.path.join(H2RNG_DATA_DIR, "pendingUpdate")
+H2RNG_INSTALL_MARKER = os.path.join(H2RNG_DATA_DIR, ".install_ok")
 H2RNG_ENGINE_DLL_PATH = os.path.join(H2RNG_DATA_DIR, "Hear2ReadNG_addon_engine.dll")
 
-try:
-    _dir=os.path.dirname(__file__.decode("mbcs"))
-except AttributeError:
-    _dir=os.path.dirname(__file__)
+_dir = os.path.dirname(__file__)
     
-OLD_H2RNG_DATA_DIR = os.path.join(os.environ['ALLUSERSPROFILE'], 
-                                  "Hear2Read-ng")
+OLD_H2RNG_DATA_DIR = os.path.join(
+    os.getenv("ALLUSERSPROFILE", r"C:\ProgramData"), "Hear2Read-ng")
+
+def copyfile_win(src, dst):
+    """Copies the file at src to dst with CopyFileExW, which uses the kernel's
+    copy path with larger I/O sizes than shutil's read/write loop, along with 
+    the file attributes and timestamps
+    """
+    if not windll.kernel32.CopyFileExW(src, dst, None, None, None, 0):
+        raise WinError()
+    return dst
+
+def move_tree(src, dst):
+    """Moves the tree at src into dst, overwriting existing files. Entries are
+    renamed into place, so no file data is copied when both are on the same
+    volume. Entries on another volume are copied instead. The emptied src
+    dirs are removed as they are done
+    """
+    # a fresh destination takes the whole tree in a single rename
+    try:
+        os.rename(src, dst)
+        return
+    except OSError:
+        pass
+
+    os.makedirs(dst, exist_ok=True)
+    with os.scandir(src) as it:
+        for entry in it:
+            dst_path = os.path.join(dst, entry.name)
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_dir and os.path.isdir(dst_path):
+                move_tree(entry.path, dst_path)
+                continue
+            try:
+                os.replace(entry.path, dst_path)
+            except OSError as e:
+                # only this entry is copied across volumes
+                if e.errno != errno.EXDEV:
+                    raise
+                if is_dir:
+                    move_tree(entry.path, dst_path)
+                else:
+                    copyfile_win(entry.path, dst_path)
+                    os.remove(entry.path)
+    os.rmdir(src)
+
+def is_in_use(path):
+    """Checks whether the file at path is locked by a running process, e.g.
+    the engine dll while Hear2Read Indic is the current synth
+    """
+    try:
+        os.close(os.open(path, os.O_RDWR))
+    except PermissionError:
+        return True
+    except OSError:
+        pass
+    return False
 
 def move_old_voices():
     """Tries to move voices downloaded in addon version 1.4 and lower to the 
     new dir structure to be usable by this addon.
     """
-    old_voices_dir = os.path.join(OLD_H2RNG_DATA_DIR, "Voices")
-
-    if os.path.isdir(OLD_H2RNG_DATA_DIR):
-        # try moving old voices
-        for file in os.listdir(old_voices_dir):
-            try:
-                src_path = os.path.join(old_voices_dir, file)
-                dst_path = os.path.join(H2RNG_VOICES_DIR, file)
-                if not file.startswith("en") and not os.path.isfile(dst_path):
-                    shutil.copy2(src=src_path, dst=dst_path)
-                os.remove(src_path)
-            except Exception as e:
-                log.warn(f"Hear2Read Indic unable to remove old voice file: "
-                         f"{file}, Exception: {e}")
-        
-        old_wavs_dir = os.path.join(OLD_H2RNG_DATA_DIR, "wavs")
-
-        if os.path.isdir(old_wavs_dir):
-            try:
-                copytree_overwrite(src=old_wavs_dir, dst=H2RNG_WAVS_DIR)
-            except Exception as e:
-                log.warn(f"Hear2Read Indic unable to copy old wav folders: {e}")
-
-        # try deleting old data
-        old_dirs = []
-        old_dirs.append(old_voices_dir)
-        old_dirs.append(old_wavs_dir)
-        old_dirs.append(os.path.join(OLD_H2RNG_DATA_DIR, "espeak-ng-data"))
-
-        for dir in old_dirs:
-            try:
-                if os.path.isdir(dir):
-                    shutil.rmtree(dir)
-            except Exception as e:
-                log.warn(f"Hear2Read Indic unable to remove old folder: {dir}, "
-                         f"Exception: {e}")
+    # a single scan of the old data dir tells which of its subdirs exist
+    try:
+        with os.scandir(OLD_H2RNG_DATA_DIR) as it:
+            old_dirs = {entry.name: entry.path for entry in it 
+                        if entry.is_dir(follow_symlinks=False)}
+    except (FileNotFoundError, NotADirectoryError):
+        return
 
+    if "Voices" in old_dirs:
+        # names already in the voices dir, so that existing voices are not
+        # overwritten
+        try:
+            with os.scandir(H2RNG_VOICES_DIR) as it:
+                existing = {entry.name for entry in it}
+        except FileNotFoundError:
+            existing = set()
+        # the voices dir is fixed, so the destination paths are built by
+        # plain concatenation
+        dst_base = H2RNG_VOICES_DIR + os.sep
+
+        # try moving old voices, failures are logged together at the end
+        failed = []
+        with os.scandir(old_dirs["Voices"]) as it:
+            for entry in it:
+                file = entry.name
+                # english and already present voices go with the old data dir
+                if file.startswith("en") or file in existing:
+                    continue
+                dst_path = dst_base + file
+                try:
+                    # a rename is enough on the same volume, fall back to a 
+                    # copy across volumes
+                    try:
+                        os.replace(entry.path, dst_path)
+                    except OSError as e:
+                        if e.errno != errno.EXDEV:
+                            raise
+                        shutil.move(entry.path, dst_path)
+                    existing.add(file)
+                except Exception as e:
+                    failed.append((file, str(e)))
+        if failed:
+            log.warn("Hear2Read Indic unable to move %d old voice files: %r", 
+                     len(failed), failed)
+
+    if "wavs" in old_dirs:
         try:
-            shutil.rmtree(OLD_H2RNG_DATA_DIR)
+            move_tree(old_dirs["wavs"], H2RNG_WAVS_DIR)
         except Exception as e:
-            log.warn("Hear2Read Indic unable to remove old Hear2Read data folder: "
-                     f"{e}")
-
-def copytree_compat(src, dst):
-    """Copytree version with overwrite compatible for Python < 3.8. This is
-    copied from the answer https://stackoverflow.com/a/13814557, and has a 
-    fairly basic functionality not accounting for symlinks, which is sufficient
-    for our purposes
-
-    @param src: path to the source, to be copied from
-    @type src: string
-    @param dst: path to the destination, to be copied to
-    @type dst: string
-    """
-    if not os.path.exists(dst):
-        os.makedirs(dst)
-    for item in os.listdir(src):
-        s = os.path.join(src, item)
-        d = os.path.join(dst, item)
-        if os.path.isdir(s):
-            copytree_compat(s, d)
-        else:
-            if not os.path.exists(d) or os.stat(s).st_mtime - os.stat(d).st_mtime > 1:
-                shutil.copy2(s, d)
-
-def copytree_overwrite(src, dst):
-    """Wrapper to enable consistent behaviour in Python version < 3.8
-
-    @param src: path to the source, to be copied from
-    @type src: string
-    @param dst: path to the destination, to be copied to
-    @type dst: string
-    """
-    if sys.version_info >= (3, 8):
-        shutil.copytree(src=src, dst=dst, dirs_exist_ok=True)
-    else:
-        copytree_compat(src=src, dst=dst)
-                
+            log.warn("Hear2Read Indic unable to move old wav folders: %s", e)
+
+    # try deleting old data, everything left is removed in one pass
+    shutil.rmtree(OLD_H2RNG_DATA_DIR, ignore_errors=True)
+
 def onInstall():
     """Copies essential Hear2Read files to the designated data folder, then
     attempts to move data from older installs to this folder.
@@ -122,33 +150,49 @@ def onInstall():
         # touch a file called update flag. This is to ensure proper update 
         # behaviour in NVDA - NVDA runs onUninstall when updating, deleting
         # old voices
-        with open(H2RNG_UPDATE_FLAG, 'a'):
-            os.utime(H2RNG_UPDATE_FLAG, None)
+        os.close(os.open(H2RNG_UPDATE_FLAG, os.O_CREAT | os.O_WRONLY))
+        dll_path = os.path.join(H2RNG_DATA_DIR, dll_name)
+        if is_in_use(dll_path):
+            # Hear2Read Indic is the current synth, so the dll is replaced 
+            # after a restart
+            dll_path += ".update"
+        # gui.messageBox(
+        #     # Translators: message telling the user that Hear2Read Indic was not installed correctly
+        #     _("Unable to update Hear2Read Indic while it is running in NVDA\n"
+        #         "Please switch to a different synthesizer, restart NVDA and retry"),
+        #     # Translators: title of a message telling the user that Hear2Read Indic was not installed correctly
+        #     _("Hear2Read Indic Install Error"),
+        #     wx.OK | wx.ICON_ERROR)
+        # raise e
         try:
             # trying moving the dll first
-            shutil.move(os.path.join(src_dir, dll_name), 
-                        os.path.join(H2RNG_DATA_DIR, dll_name))
+            os.replace(os.path.join(src_dir, dll_name), dll_path)
         except Exception as e:
-            if dll_name in str(e):
-                shutil.move(os.path.join(src_dir, dll_name), 
-                        os.path.join(H2RNG_DATA_DIR, dll_name+".update"))
-                # gui.messageBox(
-                #     # Translators: message telling the user that Hear2Read Indic was not installed correctly
-                #     _("Unable to update Hear2Read Indic while it is running in NVDA\n"
-                #         "Please switch to a different synthesizer, restart NVDA and retry"),
-                #     # Translators: title of a message telling the user that Hear2Read Indic was not installed correctly
-                #     _("Hear2Read Indic Install Error"),
-                #     wx.OK | wx.ICON_ERROR)
-                # raise e
-            else:
-                log.warn("Unable to update Hear2Read properly. Old voices may be deleted")
+            log.warn("Unable to update Hear2Read properly. Old voices may be "
+                     "deleted: %s", e)
 
     try:
-        copytree_overwrite(src=src_dir, dst=H2RNG_DATA_DIR)
-        shutil.rmtree(src_dir)
+        move_tree(src_dir, H2RNG_DATA_DIR)
+        open(H2RNG_INSTALL_MARKER, "wb").close()
     except Exception as e:
-        log.warn(f"Error installing Hear2Read Indic data files: {e}")
+        log.warn("Error installing Hear2Read Indic data files: %s", e)
+        # the addon dir is only left behind when the move failed, clear out
+        # any voices remaining in it
+        try:
+            with os.scandir(os.path.join(src_dir, "Voices")) as it:
+                src_voices = list(it)
+        except FileNotFoundError:
+            src_voices = []
+        for entry in src_voices:
+            try:
+                os.remove(entry.path)
+            except Exception as remove_error:
+                log.warn("Hear2Read Indic unable to remove file from addon "
+                         "dir: %s, Exception: %s", entry.name, remove_error)
         if dll_name in str(e):
+            # only needed on this error path
+            import gui
+            import wx
             gui.messageBox(
                 # Translators: message telling the user that Hear2Read Indic was not installed correctly
                 _("Unable to update Hear2Read Indic while it is running in NVDA\n"
@@ -158,45 +202,45 @@ def onInstall():
                 wx.OK | wx.ICON_ERROR)
             raise e
 
-    src_voice_dir = os.path.join(src_dir, "Voices")
-    if os.path.isdir(src_voice_dir):
-        for file in os.listdir(src_voice_dir):
-            try:
-                os.remove(os.path.join(src_voice_dir, file))
-            except Exception as e:
-                log.warn(f"Hear2Read Indic unable to remove file from addon dir: "
-                         f"{file}, Exception: {e}")
-
     move_old_voices()
 
     # We have renamed the addon to conform with the rule of having no spaces
     # We will try to remove the older addon
     old_addon_dir = os.path.join(os.path.dirname(_dir), "Hear2Read NG")
-    if os.path.isdir(old_addon_dir):
-        log.info("Found older version of Hear2ReadNG, removing the addon")
-        try:
-            shutil.rmtree(old_addon_dir)
-        except:
-            log.warn("Hear2ReadNG was unable to remove the old addon. Please "
-                     "remove manually")
+    try:
+        shutil.rmtree(old_addon_dir)
+        log.info("Found older version of Hear2ReadNG, removed the addon")
+    except FileNotFoundError:
+        pass
+    except:
+        log.warn("Hear2ReadNG was unable to remove the old addon. Please "
+                 "remove manually")
 
 def onUninstall():
     log.info("Hear2Read Indic uninstalling...")
     h2r_dll_update_file = H2RNG_ENGINE_DLL_PATH+".update"
-    if os.path.isfile(H2RNG_UPDATE_FLAG):
-            os.remove(H2RNG_UPDATE_FLAG)
+    # remove the update flag file so uninstall has the desired effect
+    # subsequently
+    try:
+        os.remove(H2RNG_UPDATE_FLAG)
+    except FileNotFoundError:
+        pass
 
-    if os.path.isfile(h2r_dll_update_file):
-        # remove the update flag file so uninstall has the desired effect
-        # subsequently
+    # a pending dll update means NVDA is updating the addon, not removing it
+    try:
+        # log.info("Hear2Read update from onUninstall")
+        os.replace(h2r_dll_update_file, H2RNG_ENGINE_DLL_PATH)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
         log.info("Hear2Read update. Ignoring uninstall tasks")
-        try:
-            # log.info("Hear2Read update from onUninstall")
-            shutil.move(h2r_dll_update_file, H2RNG_ENGINE_DLL_PATH)
-        except Exception as e:
-            log.error(f"Unable to install Hear2Read TTS Engine! {e}")
+        log.error(f"Unable to install Hear2Read TTS Engine! {e}")
         return
+    else:
+        log.info("Hear2Read update. Ignoring uninstall tasks")
+        return
+
     try:
         shutil.rmtree(H2RNG_DATA_DIR)
     except Exception as e:
-        log.warn(f"Error removing Hear2Read Indic files on uninstall: {e}")
\ No newline at end of file
+        log.warn("Error removing Hear2Read Indic files on uninstall: %s", e)
\ No newline at end of file
@@ -7,7 +7,8 @@
 import re
 import string
 import unicodedata
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from functools import lru_cache
 
 import config
 import gui
@@ -80,6 +81,88 @@ unicode_ranges = {
     "indic": (0x0900, 0x0DFF),
 }
 INDIC_RANGE = (0x0900, 0x0DFF)
+# speech commands that are dropped when speaking with a Hear2Read voice
+IGNORED_COMMANDS = frozenset(
+    {LangChangeCommand, BreakCommand, VolumeCommand, PhonemeCommand})
+# text replacements needed before speaking with some of the voices
+REPLACEMENT_RULES = {
+    "as": _H2R_NG_Speak.asm_replacement_rules,
+    "ml": _H2R_NG_Speak.mal_replacement_rules,
+    "mr": _H2R_NG_Speak.mar_replacement_rules,
+}
+# piper phone length for each NVDA rate from 0 to 100
+PIPER_PHONE_LEN_TABLE = tuple(
+    (1 / ((rate / 75) + (1 / 3))) if rate < 50 else (1 / (((rate - 50) / 25) + 1))
+    for rate in range(101)
+)
+# speech commands that are passed on with the text they belong to
+FORWARDED_COMMANDS = frozenset({CharacterModeCommand, BreakCommand,
+                                PitchCommand, VolumeCommand, PhonemeCommand})
+# script name and range for each 128 codepoint block of the Indic scripts
+SCRIPT_BY_BLOCK = {
+    lo >> 7: (lang, (lo, hi)) for lang, (lo, hi) in unicode_ranges.items()
+    if lang not in ("english", "indic")
+}
+# matches text that has something other than punctuation and spaces
+ALNUM_REGEX = re.compile(r'[a-zA-Z0-9]')
+NONWORD_REGEX = re.compile(r'\W')
+WHITESPACE_PUNCT = frozenset(string.whitespace + string.punctuation)
+
+# copied from the espeak addon: 
+# https://github.com/jcsteh/nvda/blob/aa5b4a0d05f6c258ada2dec7768c2d34e8910a0d/source/synthDrivers/espeak.py
+# -shyam
+XML_ESCAPES = {
+    0x3C: u"&lt;", # <: because of XML
+    0x3E: u"&gt;", # >: because of XML
+}
+# translate tables per language, shifting ASCII digits to the native script 
+# digits along with the XML escapes
+DIGIT_TABLES = {
+    lang: {**XML_ESCAPES, **{c: c + offset for c in range(0x30, 0x3A)}}
+    for lang, offset in _H2R_NG_Speak.digit_offsets.items()
+}
+
+def get_lang_iso(identifier):
+    """Gets the ISO code of the language from a voice identifier, i.e. the
+    part before the first "-" or "_"
+
+    @param identifier: the voice identifier, e.g. "hi_IN-hear2read-medium"
+    @type identifier: str
+    @return: the language ISO code
+    @rtype: str
+    """
+    return identifier.partition("-")[0].partition("_")[0]
+
+def get_script(c):
+    """Gets the script of a character, from its block for the Indic scripts
+    and from its unicode name otherwise
+
+    @param c: the character to check
+    @type c: str
+    @return: the script name and its unicode range, the Indic range if the
+    script is unknown
+    @rtype: tuple
+    """
+    entry = SCRIPT_BY_BLOCK.get(ord(c) >> 7)
+    if entry:
+        return entry
+    lang = unicodedata.name(c, UNK_SCRIPT).lower().split()[0]
+    return lang, unicode_ranges.get(lang, INDIC_RANGE)
+
+@lru_cache(maxsize=None)
+def script_regexes(script_range):
+    """Gets the regexes matching runs of text in a script. The first matches
+    characters of the script (and dandas), the second also takes in the
+    spaces, punctuation and digits that follow them
+
+    @param script_range: the first and last code points of the script
+    @type script_range: tuple
+    @return: the compiled regexes for starting and continuing a run
+    @rtype: tuple
+    """
+    lo, hi = (re.escape(chr(c)) for c in script_range)
+    script = f"{lo}-{hi}।॥"
+    return re.compile(f"[{script}]+"), re.compile(rf"[{script}\W0-9_]+")
 
 class SynthDriver(SynthDriver):
     name = ADDON_NAME
@@ -107,6 +190,11 @@ class SynthDriver(SynthDriver):
     supportedNotifications = {synthIndexReached, synthDoneSpeaking}
 
     __voices = dict()
+    # VoiceInfo dict built from __voices, cleared when __voices changes
+    _voicesCache = None
+    # unicode range of the script of the current voice, and that voice
+    _script_range = ()
+    _script_voice = None
 
     @classmethod
     def check(cls):
@@ -173,7 +261,8 @@ class SynthDriver(SynthDriver):
         #         self.eng_synth._set_voice(eng_voice)
 
         self.__voices = populateVoices()
-        self.subsequences = []
+        self._voicesCache = None
+        self.subsequences = deque()
         self._variant="0"
         self.alpha_regex = re.compile("([a-zA-Z]+)", re.ASCII)
         synthIndexReached.register(self._receiveIndexNotification)
@@ -182,26 +271,19 @@ class SynthDriver(SynthDriver):
 
     def _processText(self, text):
         # We need to make several replacements.
+        table = XML_ESCAPES
         if not text.isascii():
-            if self._get_language() == "as":
-                text = _H2R_NG_Speak.asm_replacement_rules(text)
-            elif self._get_language() == "ml":
-                text = _H2R_NG_Speak.mal_replacement_rules(text)
-            elif self._get_language() == "mr":
-                text = _H2R_NG_Speak.mar_replacement_rules(text)
-                
-            digit_offset = _H2R_NG_Speak.digit_offsets.get(self._get_language(), 0)
-            text = ''.join([chr(ord(x) + digit_offset) if 48 <= ord(x) <= 58 else x for x in text])
+            lang = self._get_language()
+            replacement_rules = REPLACEMENT_RULES.get(lang)
+            if replacement_rules:
+                text = replacement_rules(text)
+
+            # the digit shift happens in the same pass as the XML escapes
+            table = DIGIT_TABLES.get(lang, XML_ESCAPES)
 
             text = text.rstrip() # strip trailing space, required for char mode on conjuncts
-        
-        # copied from the espeak addon: 
-        # https://github.com/jcsteh/nvda/blob/aa5b4a0d05f6c258ada2dec7768c2d34e8910a0d/source/synthDrivers/espeak.py
-        # -shyam
-        return text.translate({
-            0x3C: u"&lt;", # <: because of XML
-            0x3E: u"&gt;", # >: because of XML
-        })
+
+        return text.translate(table)
 
     def _get_language(self):
         # lang = _H2R_NG_Speak.getCurrentVoice().split("-")[0].split("_")[0]
@@ -211,12 +293,23 @@ class SynthDriver(SynthDriver):
     def speak(self, speechSequence: SpeechSequence):
         # log.info("H2R speak")
         # log.info(f"speech sequence: {speechSequence}")
-        self.subsequences = []
+        self.subsequences = deque()
         self.first_subseq = True
         if self.is_curr_voice_eng() or not self._get_voice():
             # self.subsequences.append(speechSequence)
             _H2R_NG_Speak.speak_eng(speech_sequence=speechSequence)
             return
+        # sequences with only ASCII text, e.g. while typing or navigating, 
+        # need no splitting and go straight to the English synth. A sequence
+        # of only LangChangeCommands is left to the full path, which speaks 
+        # nothing
+        if all(item.isascii() for item in speechSequence 
+               if isinstance(item, str)):
+            eng_sequence = [item for item in speechSequence 
+                            if not isinstance(item, LangChangeCommand)]
+            if eng_sequence:
+                _H2R_NG_Speak.speak_eng(speech_sequence=eng_sequence)
+                return
         isPrevASCII = True
         firstText = True
         self.currIndex = 0
@@ -229,7 +322,8 @@ class SynthDriver(SynthDriver):
         # log.info(f"got script range: {hex(self._script_range[0])} - {hex(self._script_range[1])}")
 
         for item in speechSequence:
-            if isinstance(item,str):
+            itemType = type(item)
+            if itemType is str:
                 text = item
                 # log.info(f"speechSequence: {text}")
                 isCurrASCII = item.isascii()
@@ -237,7 +331,7 @@ class SynthDriver(SynthDriver):
                     # quick hack to check if text has ascii and unicode characters
                     if text.upper().isupper():
                         if subSequence:
-                            self.subsequences.append((isPrevASCII, subSequence))
+                            self._add_subsequence(isPrevASCII, subSequence)
                         self._process_mixed_text(text, indexCmd)
                         indexCmd = None
                         subSequence = []
@@ -250,12 +344,12 @@ class SynthDriver(SynthDriver):
 
                     if len(split_unicode_texts) > 1:
                         if subSequence:
-                            self.subsequences.append((isPrevASCII, subSequence))
+                            self._add_subsequence(isPrevASCII, subSequence)
                             subSequence = []
                         for isASCII, txt in split_unicode_texts:
                             subSequence.append(txt)
                             subSequence.append(IndexCommand(self.negIndex))
-                            self.subsequences.append((isASCII, subSequence))
+                            self._add_subsequence(isASCII, subSequence)
                             subSequence = []
                             self.negIndex -= 1
                         continue
@@ -266,7 +360,7 @@ class SynthDriver(SynthDriver):
                 if not firstText and isPrevASCII != isCurrASCII:
                     # if isASCII:
                     if subSequence:
-                        self.subsequences.append((isPrevASCII, subSequence))
+                        self._add_subsequence(isPrevASCII, subSequence)
                         isPrevASCII = isCurrASCII
                         subSequence = []
                     # elif text.upper().isupper():
@@ -276,58 +370,19 @@ class SynthDriver(SynthDriver):
                 subSequence.append(text)
                 isPrevASCII = isCurrASCII
                 firstText = False
-            elif isinstance(item, IndexCommand):
+            elif itemType is IndexCommand:
                 indexCmd = item
                 subSequence.append(item)
-                # pass
-            elif isinstance(item, CharacterModeCommand):
+            elif itemType in FORWARDED_COMMANDS:
                 subSequence.append(item)
-                # pass
-            elif isinstance(item, LangChangeCommand):
+            elif itemType is LangChangeCommand:
                 pass
-            elif isinstance(item, BreakCommand):
-                subSequence.append(item)
-                # pass
-            elif isinstance(item, PitchCommand):
-                # log.info(f"Hear2Read got PitchCommand: {item}")
-                subSequence.append(item)
-                # synth = getSynth()
-                # synthConf = config.conf["speech"][synth.name]
-                # h2rpitch = synthConf["pitch"]
-                # log.info(f"Hear2ReadNG: current pitch at: {h2rpitch}, {type(h2rpitch)}")
-                # pass
-            elif isinstance(item, VolumeCommand):
-                subSequence.append(item)
-                # pass
-            elif isinstance(item, PhonemeCommand):
-                subSequence.append(item)
-                # pass
             else:
                 log.error("Unknown speech: %s"%item)
             # subSequence.append(item)  
             
         if subSequence:
-            self.subsequences.append((isPrevASCII, subSequence))
-
-        # log.info("Joining subsequences: ")
-        subsequences_joined = []
-        for isEng, subSeq in self.subsequences:
-            # log.info(f"subseq: isEng {isEng}, {subSeq}")
-            # isASCII = txt.isascii()
-            if not subsequences_joined:
-                subsequences_joined.append([isEng, subSeq])
-                isPrevEng = isEng
-            elif isPrevEng == isEng:
-                #   txt.isascii()==split_texts[-1].isascii()):
-                # if not split_texts[-1].isascii and split_texts_base[i+1].isascii:
-                #     continue
-                subsequences_joined[-1][1].extend(subSeq)
-            else:
-                subsequences_joined.append([isEng, subSeq])
-                isPrevEng = isEng
-
-        self.subsequences = [(isEng, subSeq)
-                             for isEng, subSeq in subsequences_joined]
+            self._add_subsequence(isPrevASCII, subSequence)
         
         # log.info("Printing subsequences: ")
         # for isEng, subSeq in self.subsequences:
@@ -338,32 +393,23 @@ class SynthDriver(SynthDriver):
 
     def _process_mixed_text(self, text, idxCmd):
         # log.info(f"_process_mixed_text: {text}, {idxCmd}")
-        split_texts = self.alpha_regex.split(text)
-        # log.info(f"mixed texts: {split_texts}")
-        split_texts_checked = []
+        # the joined texts are kept as lists of parts and joined once below
         split_texts_joined = []
 
-        for txt in split_texts:
+        for txt in self.alpha_regex.split(text):
             if txt.isascii():
-                split_texts_checked.append([True, txt])
-            else:
-                split_unicode_texts = self._process_non_native_unicode(txt)
-                split_texts_checked.extend(split_unicode_texts)
-
-        for isASCII, txt in split_texts_checked:
-            # isASCII = txt.isascii()
-            if not split_texts_joined:
-                split_texts_joined.append([isASCII, txt])
-                isPrevASCII = isASCII
-            elif (self.is_nontext(txt) or 
-                  isPrevASCII == isASCII):
-                #   txt.isascii()==split_texts[-1].isascii()):
-                # if not split_texts[-1].isascii and split_texts_base[i+1].isascii:
-                #     continue
-                split_texts_joined[-1][1] += txt
+                split_texts_checked = ((True, txt),)
             else:
-                split_texts_joined.append([isASCII, txt])
-                isPrevASCII = isASCII
+                split_texts_checked = self._process_non_native_unicode(txt)
+
+            for isASCII, part in split_texts_checked:
+                if split_texts_joined and (split_texts_joined[-1][0] == isASCII
+                                           or self.is_nontext(part)):
+                    split_texts_joined[-1][1].append(part)
+                else:
+                    split_texts_joined.append([isASCII, [part]])
+        split_texts_joined = [(isASCII, "".join(parts)) 
+                              for isASCII, parts in split_texts_joined]
         
         # log.info(f"mixed texts cleaned: {split_texts_joined}")
 
@@ -376,7 +422,7 @@ class SynthDriver(SynthDriver):
                 subSequence.append(txt)
                 subSequence.append(IndexCommand(self.negIndex))
                 # log.info(f"appending subseq \"{txt}\", idx: {self.negIndex}")
-                self.subsequences.append((isASCII, subSequence))
+                self._add_subsequence(isASCII, subSequence)
                 subSequence = []
                 self.negIndex-=1
         isASCII, txt = split_texts_joined[-1]
@@ -386,17 +432,31 @@ class SynthDriver(SynthDriver):
             self.negIndex -= 1
         subSequence.append(idxCmd)
         # log.info(f"appending subseq \"{txt}\", idx: {idxCmd}")
-        self.subsequences.append((isASCII, subSequence))
+        self._add_subsequence(isASCII, subSequence)
         
     def is_nontext(self, txt):
-        ret = txt.isascii() and not bool(re.search(r'[a-zA-Z0-9]', txt))
+        ret = txt.isascii() and not ALNUM_REGEX.search(txt)
         return ret
 
+    def _add_subsequence(self, isEng, subSequence):
+        """Queues a subsequence to be spoken, joining it to the previous one
+        if both are for the same synth
+
+        @param isEng: whether the subsequence is for the English synth
+        @type isEng: bool
+        @param subSequence: the speech sequence to queue
+        @type subSequence: SpeechSequence
+        """
+        if self.subsequences and self.subsequences[-1][0] == isEng:
+            self.subsequences[-1][1].extend(subSequence)
+        else:
+            self.subsequences.append((isEng, subSequence))
+
     def _processSubSequences(self):
         if not self.subsequences:
             log.warn("Hear2Read: No speech sequences to process!")
             return
-        isASCII, subSequence = self.subsequences.pop(0)
+        isASCII, subSequence = self.subsequences.popleft()
         # log.info(f"_processSubSequences: isASCII: {isASCII}")
         # log.info(f"_processSubsequence: subsequence {subSequence}")
 
@@ -419,51 +479,58 @@ class SynthDriver(SynthDriver):
     def _process_non_native_unicode(self, text):
         split_texts = []
         prev_range = ()
-        text_bit = ""
+        text_bit = []
         # has_curr_lang = False
         is_prev_valid_lang = False
 
         # log.info(f"_process_non_native_unicode: {text}")
 
-        for c in text:
-            # log.info(f"checking: {c}")
-            if self._script_range[0] <= ord(c) <=self._script_range[1] or c in "।॥":
-                # log.info(f"adding: {c}")
-                text_bit += c
+        # runs of the current script, along with the spaces, punctuation and
+        # digits following them, are taken in a single regex match
+        run_regex, cont_regex = script_regexes(self._script_range)
+        # text wholly in the current script, e.g. a paragraph of a Hindi
+        # document, is a single run
+        if run_regex.match(text) and cont_regex.fullmatch(text):
+            return [[False, text]]
+        i = 0
+        while i < len(text):
+            regex = cont_regex if is_prev_valid_lang else run_regex
+            match = regex.match(text, i)
+            if match:
+                # log.info(f"adding: {match.group()}")
+                text_bit.append(match.group())
                 # has_curr_lang = True
                 is_prev_valid_lang = True
+                i = match.end()
                 continue
 
-            if c in string.whitespace or c in string.punctuation:
+            c = text[i]
+            i += 1
+            # log.info(f"checking: {c}")
+
+            if c in WHITESPACE_PUNCT:
                 if is_prev_valid_lang:
                     # log.info(f"adding punct: {c}")
-                    text_bit += c
+                    text_bit.append(c)
                 continue
 
-            if  c in string.digits or re.match("\\W", c):
+            if c in string.digits or NONWORD_REGEX.match(c):
                 if is_prev_valid_lang:
                     # log.info(f"extending unicode nonalpha: {c}")
-                    text_bit += c
+                    text_bit.append(c)
                 else:
                     # log.info(f"adding unicode nonalpha: {c}")
                     split_texts.append((True, c))
                 continue
 
-            # send all non Indic, Unicode punct to English (em, en dashes etc)
-            if re.match("\\W", c):
-                # log.info(f"adding unicode nonalphanumeric: {c}")
-                split_texts.append((True, c))
-                continue
-
             if not prev_range:
                 # log.info(f"first non native: {c}")
-                lang = unicodedata.name(c, UNK_SCRIPT).lower().split()[0]
-                prev_range = unicode_ranges.get(lang, (0x0900, 0x0DFF))
+                lang, prev_range = get_script(c)
                 # if not prev_range:
                 #     prev_range = unicode_ranges["indic"]
                 if text_bit:
-                    split_texts.append((False, text_bit))
-                    text_bit = ""
+                    split_texts.append((False, "".join(text_bit)))
+                    text_bit = []
                     is_prev_valid_lang = False
 
                 # log.info(f"adding first non native: {lang}")
@@ -481,35 +548,35 @@ class SynthDriver(SynthDriver):
                 # log.info("is_prev_curr_lang")
                 continue
 
-            lang = unicodedata.name(c, UNK_SCRIPT).lower().split()[0]
-
-            prev_range = unicode_ranges.get(lang, (0x0900, 0x0DFF))
+            lang, prev_range = get_script(c)
 
             if text_bit:
-                split_texts.append((False, text_bit))
-                text_bit = ""
+                split_texts.append((False, "".join(text_bit)))
+                text_bit = []
                 is_prev_valid_lang = False
                 
             split_texts.append((True, f"{lang} script"))
 
         if text_bit:
-            split_texts.append((False, text_bit))
+            split_texts.append((False, "".join(text_bit)))
 
         # log.info(f"first run splits: {split_texts}")
 
+        # runs are kept as lists of parts and joined once at the end
         split_texts_joined = []
 
         for isASCII, text in split_texts:
             if split_texts_joined and split_texts_joined[-1][0] == isASCII:
-                split_texts_joined[-1][1] += text
+                split_texts_joined[-1][1].append(text)
                 # split_texts_joined[-1] = (isASCII, split_texts_joined[-1][1]
                 #                           + text)
             else:
-                split_texts_joined.append([isASCII, text])
+                split_texts_joined.append([isASCII, [text]])
 
         # log.info(f"_process_non_native_unicode: o/p: {split_texts_joined}")
 
-        return split_texts_joined
+        return [[isASCII, "".join(parts)] 
+                for isASCII, parts in split_texts_joined]
 
 
     def _speak_h2r(self, speechSequence: SpeechSequence):
@@ -525,31 +592,28 @@ class SynthDriver(SynthDriver):
         textSSML = []
         # log.info(f"_speak_h2r: speech sequence: {speechSequence}")
         for item in speechSequence:
-            if isinstance(item,str):
+            itemType = type(item)
+            if itemType is str:
                 textSSML.append(self._processText(item))
-            elif isinstance(item, IndexCommand):
-                textSSML.append("<mark " + str(item.index) + ">")
-            elif isinstance(item, CharacterModeCommand):
+            elif itemType is IndexCommand:
+                textSSML.append(f"<mark {item.index}>")
+            elif itemType is CharacterModeCommand:
                 charMode = item.state
-            elif isinstance(item, LangChangeCommand):
-                pass
-            elif isinstance(item, BreakCommand):
-                pass
-            elif isinstance(item, VolumeCommand):
-                pass
-            elif isinstance(item, PhonemeCommand):
+            elif itemType in IGNORED_COMMANDS:
                 pass
             else:
                 log.error("Unknown speech: %s"%item)
-        
-        textmarked=u"".join(textSSML)           
-        if (textmarked != ""):
+
+        if not textSSML:
+            return
+        textmarked = "".join(textSSML)
+        if textmarked:
             params = _H2R_NG_Speak.SpeechParams(piperPhoneLen, amplitude, charMode)
             _H2R_NG_Speak.speak(textmarked, params)
 
     def cancel(self):
         # log.info("cancel")
-        self.subsequences = []
+        self.subsequences = deque()
         _H2R_NG_Speak.stop()
 
     def pause(self,switch):
@@ -571,7 +635,7 @@ class SynthDriver(SynthDriver):
         # NVDA sends a rate between 0 and 100
         global nvdaRate, piperPhoneLen
         nvdaRate = rate
-        piperPhoneLen = (1 / (((rate) / 75) + (1 / 3))) if (rate < 50) else (1 / (((rate - 50) / 25) + 1))
+        piperPhoneLen = PIPER_PHONE_LEN_TABLE[max(0, min(100, int(rate)))]
         
     def _get_volume(self):
         # we use the English voice setting to set English rate and volume
@@ -595,11 +659,15 @@ class SynthDriver(SynthDriver):
     def _getAvailableVoices(self):
         if not self.__voices:
             self.__voices = populateVoices()
+            self._voicesCache = None
 
-        # return OrderedDict((voiceID,VoiceInfo(voiceID,voiceName,"en"))
-        #         for voiceID, voiceName in self.__voices.items())
-        return OrderedDict((voiceID,VoiceInfo(voiceID,voiceName,voiceID.split("-")[0].split("_")[0]))
+        if self._voicesCache is None:
+            # return OrderedDict((voiceID,VoiceInfo(voiceID,voiceName,"en"))
+            #         for voiceID, voiceName in self.__voices.items())
+            self._voicesCache = OrderedDict(
+                (voiceID, VoiceInfo(voiceID, voiceName, get_lang_iso(voiceID)))
                 for voiceID, voiceName in self.__voices.items())
+        return self._voicesCache
 
     def _get_voice(self):
         # log.info("H2R get_voice")
@@ -627,31 +695,24 @@ class SynthDriver(SynthDriver):
         
         # modifying to prevent crash on deleting a selected voice b/w sessions
         # -shyam 231107
-        if identifier not in self.__voices.keys():            
+        if identifier not in self.__voices:
             self.__voices = populateVoices()
+            self._voicesCache = None
             
-            if identifier not in self.__voices.keys():
+            if identifier not in self.__voices:
                 log.warn(f"Hear2Read voice not found: {identifier}, "
                          "setting available voice")
-                res = _H2R_NG_Speak.setVoiceByLanguage(identifier.split("-")[0].split("_")[0])
+                res = _H2R_NG_Speak.setVoiceByLanguage(get_lang_iso(identifier))
         
         else:
-            try:
-            #TODO better exception handling
-                res = _H2R_NG_Speak._setVoiceByIdentifier(voiceID=identifier)
-                if res != EE_OK:
-                    log.warn(f"Hear2Read unable to set voice {identifier}, setting by lang")
-                    res = _H2R_NG_Speak.setVoiceByLanguage(
-                        identifier.split("-")[0].split("_")[0])
-                else:
-                    _H2R_NG_Speak.set_player()
+            res = _H2R_NG_Speak._setVoiceByIdentifier(voiceID=identifier)
+            if res != EE_OK:
+                log.warn(f"Hear2Read unable to set voice {identifier}, setting by lang")
+                _H2R_NG_Speak.setVoiceByLanguage(get_lang_iso(identifier))
+            else:
+                _H2R_NG_Speak.set_player()
+            return
 
-                # lang_iso = identifier.split("_")[0].split("-")[0]
-                return
-            except Exception as e:
-                raise e
-                return            
-            
         if res != EE_OK:
             # self.on_no_voices(id=identifier)
             _H2R_NG_Speak.setVoiceByLanguage("en")
@@ -660,9 +721,15 @@ class SynthDriver(SynthDriver):
         self._set_script_range()
 
     def _set_script_range(self):
+        # this runs for every speak call, so the range is only worked out
+        # again when the voice changes
+        voice = self._get_voice()
+        if self._script_range and voice == self._script_voice:
+            return
+        self._script_voice = voice
 
         try:
-            lang_iso = self._get_voice().split("_")[0].split("-")[0]
+            lang_iso = get_lang_iso(voice)
         except AttributeError as e:
             self._script_range = unicode_ranges["english"]
             return
@@ -688,7 +755,7 @@ class SynthDriver(SynthDriver):
 
     def _receiveIndexNotification(self, synth, index):
         # log.info(f"received index reached: {index}, from: {synth.name}")
-        if self.name != synth.name:
+        if synth is not self:
             synthIndexReached.notify(synth=self, index=index)
             return
         # if index == self.currIndex and self.subsequences:
@@ -696,7 +763,7 @@ class SynthDriver(SynthDriver):
 
     def _receiveDoneNotification(self, synth):
         # log.info(f"received synth done: {synth.name}")
-        if self.name != synth.name:
+        if synth is not self:
             if self.subsequences:
                 self._processSubSequences()
             else:
@@ -725,5 +792,4 @@ class SynthDriver(SynthDriver):
         @return: Return True if the current voice is English
         @rtype: bool
         """
-        return (_H2R_NG_Speak.getCurrentVoice() and 
-                _H2R_NG_Speak.getCurrentVoice().startswith("en"))
\ No newline at end of file
+        return _H2R_NG_Speak.curr_voice_is_eng
\ No newline at end of file
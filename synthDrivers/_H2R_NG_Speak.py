@@ -88,6 +88,8 @@ onIndexReached = None
 bgThread=None
 bgQueue = None
 player = None
+# players by voice quality, kept open so that switching voices reuses them
+players = {}
 H2RNG_SpeakDLL=None
 
 
@@ -112,8 +114,29 @@ qual_to_hz = {"low":16000, "med":22050}
 digit_offsets = {"as": 2486, "ne":2358}
 
 curr_voice = ""
+# whether curr_voice is an English voice, kept in step by setCurrentVoice
+curr_voice_is_eng = False
 curr_qual = ""
 
+# size in bytes of one sample of the 16 bit PCM audio from the engine
+SAMPLE_WIDTH = sizeof(c_int16)
+
+# names spoken for signs that make no sound on their own in character mode
+CHARACTER_MODE_NAMES = {
+    0x0901: "चंद्रबिंदु.",  # chandrabindu
+    0x0902: "अनुस्वार.",  # anuswaara
+    0x0903: "विसर्ग.",  # visarga
+    0x093C: "नुक्ता.",  # nukta
+    0x094D: "हलन्त.",  # halant
+    0x0981: "চন্দ্ৰবিন্দু",
+    0x0982: "উনস্বৰ",
+    0x0983: "বিসৰ্গ",
+    0x09CD: "হছন্ত",
+    0x0D4D: "ചന്ദ്രക്കല",
+    0x0D02: "അനുസ്വാരം",
+    0x0D03: "വിസർഗം",
+}
+
 # constants that can be returned by H2R_Speak_callback
 CALLBACK_CONTINUE_SYNTHESIS=0
 CALLBACK_ABORT_SYNTHESIS=1
@@ -149,8 +172,9 @@ def getCurrentVoice():
         
 def setCurrentVoice(voiceID):
     # log.info(f"H2R setCurrentVoice: {voiceID}")
-    global curr_voice
+    global curr_voice, curr_voice_is_eng
     curr_voice = voiceID
+    curr_voice_is_eng = bool(voiceID) and voiceID.startswith("en")
 
 @t_H2RNG_audiocallback
 def audiocallback(wav, numsamples): #, isEng):
@@ -176,8 +200,6 @@ def audiocallback(wav, numsamples): #, isEng):
             onIndexReached(None)
             return CALLBACK_ABORT_SYNTHESIS
         
-        prevByte = 0
-        
         #write wav to file to test output
         # with wave.open(os.path.join(H2RNG_DATA_DIR, str(i) + ".wav"), "w") as f:
             # f.setnchannels(1)
@@ -186,7 +208,8 @@ def audiocallback(wav, numsamples): #, isEng):
             # f.writeframes(wav_str)
         # i=i+1
             
-        player.feed(wav, size=numsamples * sizeof(c_int16))
+        # the player copies the samples out of the engine's buffer
+        player.feed(wav, size=numsamples * SAMPLE_WIDTH)
 
         return CALLBACK_CONTINUE_SYNTHESIS
         
@@ -200,8 +223,8 @@ def indexcallback(index):
 
 class BgThread(threading.Thread):
     def __init__(self):
-        super().__init__(name=f"{self.__class__.__module__}.{self.__class__.__qualname__}")
-        self.setDaemon(True)
+        super().__init__(name=f"{self.__class__.__module__}.{self.__class__.__qualname__}",
+                         daemon=True)
 
     def run(self):
         while True:
@@ -233,72 +256,12 @@ def _speak(text, params):
     returncode = H2RNG_SpeakDLL.H2R_Speak_synthesizeText(text2, params)
     return returncode
 
-def findNextTerminator(string, start):
-    index = start
-
-    whitespace = { " ", "\r", "\t", "\n"  }
-    while (index < len(string)) :
-
-        if (string[index] == "." or 
-            string[index] == "!" or
-            string[index] == "?" or
-            string[index] == ";" or
-            ord(string[index]) == 0x0964) :
-
-            if (string[index + 1] in whitespace):
-                break
-        index += 1
-
-    if start == index: 
-        return 0
-    
-    return index
-    
 def characterMode(text):
     
-    if len(text) > 1:
+    if len(text) != 1:
         return text
         
-    unicodeHex = ord(text)
-    if unicodeHex == 0x0901:
-    # chandrabindu
-        return "चंद्रबिंदु."
-    if unicodeHex == 0x0902:
-    # anuswaara
-        return "अनुस्वार."
-    if unicodeHex == 0x0901:
-    # visarga
-        return "विसर्ग."
-    if 0x0915 <= unicodeHex <= 0x0939:
-    # add a to consonants
-        return text #+ chr(0x093E) + "."
-    if unicodeHex == 0x093C:
-    # nukta
-        return "नुक्ता."
-    # if 0x093E <= unicodeHex <= 0x094C:
-    # # vowel signs - convert to independent vowel
-        # return chr(unicodeHex - 0x38) + "."
-    if unicodeHex == 0x094D:
-    # halant
-        return "हलन्त."
-        
-    if unicodeHex == 0x0981:
-        return "চন্দ্ৰবিন্দু"
-    if unicodeHex == 0x0982:
-        return "উনস্বৰ"
-    if unicodeHex == 0x0983:
-        return "বিসৰ্গ"
-    if unicodeHex == 0x09CD:
-        return "হছন্ত"
-        
-    if unicodeHex == 0x0D4D:
-        return "ചന്ദ്രക്കല"
-    if unicodeHex == 0x0D02:
-        return "അനുസ്വാരം"
-    if unicodeHex == 0x0D03:
-        return "വിസർഗം"
-        
-    return text
+    return CHARACTER_MODE_NAMES.get(ord(text), text)
     
 def asm_replacement_rules(text):
 # replace bengali ra and nuqta combinations with single char
@@ -403,8 +366,11 @@ def set_player():
 
     if curr_qual != qual or not player:
         if player:
-            player.close()
+            player.stop()
         curr_qual = qual
+        player = players.get(qual)
+        if player:
+            return
         
         # Compatibility for NVDA version < 2025.1
         try:
@@ -417,6 +383,7 @@ def set_player():
                             bitsPerSample=16,
                             outputDevice=audioDevice)#,
                             # buffered=True) deprecated, removed 2025.1
+        players[qual] = player
 
 
 def _setVoiceByIdentifier(voiceID):    
@@ -468,35 +435,30 @@ def setVoiceByLanguage(lang):
         return en_voice
         
     #Get all files in the Voices Directory
-    pathName = os.path.join(H2RNG_VOICES_DIR)
-    file_list = os.listdir(pathName)
-    
+    file_list = os.listdir(H2RNG_VOICES_DIR)
+    file_set = set(file_list)
+
+    # a voice for the language if there is one, else the first voice found
+    voice_id = None
     for file_name in file_list:
-        parts = file_name.split(".")
-        if parts[-1] == "onnx":
+        if (not file_name.endswith(".onnx") 
+            or f"{file_name}.json" not in file_set):
+            continue
         # Found one of the NVDA Addon onnx voice file
-            # log.info("_H2R_NG_Speak setVoiceByLanguage: parts = %s", parts[0])
-            file_lang = parts[0].split("-")[0]
-            if file_lang == lang and (f"{file_name}.json") in file_list:
-                # matching language
-                
-                # log.info("_H2R_NG_Speak:setVoiceByLanguage - found %s for lang %s",file_lang, lang)
-
-                hr = _setVoiceByIdentifier(parts[0])
-                setCurrentVoice(parts[0])
-                set_player()
-                return getCurrentVoice()
-                
-                # TODO: send error message on fail
+        file_voice_id = file_name.partition(".")[0]
+        if file_voice_id.partition("-")[0] == lang:
+            # matching language
+            voice_id = file_voice_id
+            break
+        if voice_id is None:
+            voice_id = file_voice_id
 
-    for file_name in file_list:
-        parts = file_name.split(".")
-        if parts[-1] == "onnx":
-            if (f"{file_name}.json") in file_list:
-                hr = _setVoiceByIdentifier(parts[0])
-                setCurrentVoice(parts[0])
-                set_player()
-                return getCurrentVoice()
+    if voice_id:
+        # TODO: send error message on fail
+        _setVoiceByIdentifier(voice_id)
+        setCurrentVoice(voice_id)
+        set_player()
+        return getCurrentVoice()
     
     log.warn("Hear2Read no voices found")
     return None
@@ -675,11 +637,18 @@ def speak_eng(speech_sequence):
     if EngSynth:
         EngSynth.speak(speech_sequence)
     
+# seconds to wait for the update server before giving up
+UPDATE_CHECK_TIMEOUT = 3
+
 # TODO remove deprecated?
 def _checkIfUpdates():
     show_update = False
     stamp_url = 'https://hear2read.org/nvda-addon/getNGUpdateStamp.php'
-    server_stamp = urlopen(stamp_url).read()
+    try:
+        server_stamp = urlopen(stamp_url, timeout=UPDATE_CHECK_TIMEOUT).read()
+    except OSError as e:
+        log.warn("Hear2Read update check failed: %s", e)
+        return
     stamp_file = os.path.join(H2RNG_DATA_DIR, "ng-update")
     if os.path.isfile(stamp_file):
         with open(stamp_file, encoding="utf-8") as f:
@@ -759,8 +728,9 @@ def terminate():
         del H2RNG_SpeakDLL
     bgThread=None
     bgQueue=None
-    if player:
-        player.close()
+    for qual_player in players.values():
+        qual_player.close()
+    players.clear()
     player=None
     onIndexReached = None
     if EngSynth: